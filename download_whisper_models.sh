@@ -13,6 +13,10 @@ echo ""
 # Lista modelli disponibili
 models=("tiny" "base" "small" "medium" "large")
 
+# Variante quantizzata opzionale (es. QUANT=q5_1 o QUANT=q8_0): più veloce su CPU,
+# preferita da web_app_simple.py quando presente. Non tutte le combinazioni esistono.
+QUANT="${QUANT:-}"
+
 for model in "${models[@]}"; do
     model_file="${model}.bin"
     if [ -f "$model_file" ]; then
@@ -26,6 +30,22 @@ for model in "${models[@]}"; do
             echo "✗ Errore download modello $model"
         fi
     fi
+    
+    if [ -n "$QUANT" ]; then
+        quant_file="ggml-${model}-${QUANT}.bin"
+        if [ -f "$quant_file" ]; then
+            echo "✓ Modello $model ($QUANT) già presente: $quant_file"
+        else
+            echo "Download modello $model ($QUANT)..."
+            url="https://huggingface.co/ggerganov/whisper.cpp/resolve/main/${quant_file}"
+            if curl -fL -o "$quant_file" "$url"; then
+                echo "✓ Modello $model ($QUANT) scaricato: $quant_file"
+            else
+                rm -f "$quant_file"
+                echo "✗ Variante $QUANT non disponibile per $model"
+            fi
+        fi
+    fi
 done
 
 echo ""
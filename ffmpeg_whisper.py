@@ -419,15 +419,19 @@ def process_live_stream_ffmpeg_whisper(
                 ffmpeg_process.terminate()
                 break
             
-            # Cerca nuovi chunk
+            # Cerca nuovi chunk: una sola lettura della directory per iterazione
+            entries = {e.name: e for e in os.scandir(chunk_dir)}
             for i in range(chunk_counter, chunk_counter + 10):
-                chunk_file = os.path.join(chunk_dir, f"chunk_{i:04d}.wav")
+                entry = entries.get(f"chunk_{i:04d}.wav")
+                if entry is None:
+                    continue
+                chunk_file = entry.path
                 
-                if os.path.exists(chunk_file) and chunk_file not in processed_chunks:
+                if chunk_file not in processed_chunks:
                     processed_chunks.add(chunk_file)
                     time.sleep(0.5)  # Aspetta che il file sia completo
                     
-                    if os.path.getsize(chunk_file) == 0:
+                    if entry.stat().st_size == 0:  # stat dopo l'attesa: dimensione aggiornata
                         continue
                     
                     print(f"[Chunk {i}] Trascrizione...", end=" ", flush=True)
@@ -478,17 +482,24 @@ def process_live_stream_ffmpeg_whisper(
                                             'index': subtitle_index,
                                             'start': chunk_start_time,
                                             'end': chunk_end_time,
+                                            # Timestamp SRT formattati una sola volta, riusati ad ogni riscrittura
+                                            'start_str': format_srt_time(chunk_start_time),
+                                            'end_str': format_srt_time(chunk_end_time),
                                             'text': text
                                         }
                                         all_subtitles.append(subtitle)
                                         
                                         # Aggiorna file output
                                         if output_file:
-                                            with open(output_file, 'w', encoding='utf-8') as f:
-                                                for sub in all_subtitles:
-                                                    f.write(f"{sub['index']}\n")
-                                                    f.write(f"{format_srt_time(sub['start'])} --> {format_srt_time(sub['end'])}\n")
-                                                    f.write(f"{sub['text']}\n\n")
+                                            # Serializza tutto in memoria e scrive con una sola write()
+                                            payload = b"".join(
+                                                f"{sub['index']}\n"
+                                                f"{sub['start_str']} --> {sub['end_str']}\n"
+                                                f"{sub['text']}\n\n".encode('utf-8')
+                                                for sub in all_subtitles
+                                            )
+                                            with open(output_file, 'wb') as f:
+                                                f.write(payload)
                                         
                                         print(f"✓ ({transcribe_time:.1f}s) - {text[:60]}...")
                                         subtitle_index += 1
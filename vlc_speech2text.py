@@ -12,6 +12,8 @@ import tempfile
 import threading
 import queue
 import time
+import stat
+from functools import lru_cache
 from pathlib import Path
 
 try:
@@ -31,27 +33,129 @@ except ImportError:
     PYDUB_AVAILABLE = False
     # Non stampare avviso qui - sarà mostrato solo se si usa --realtime
 
+# faster-whisper è opzionale: backend CTranslate2 con inferenza batched,
+# usato da chi lo richiede esplicitamente (server web)
+try:
+    from faster_whisper import WhisperModel, BatchedInferencePipeline
+    FASTER_WHISPER_AVAILABLE = True
+except ImportError:
+    FASTER_WHISPER_AVAILABLE = False
+
+# Su GPU la trascrizione usa FP16 (openai-whisper) o pesi INT8 con attivazioni
+# FP16 (faster-whisper); su CPU FP32 o INT8
+CUDA_AVAILABLE = torch.cuda.is_available()
+DEVICE = "cuda" if CUDA_AVAILABLE else "cpu"
+USE_FP16 = CUDA_AVAILABLE
+FASTER_WHISPER_COMPUTE_TYPE = "int8_float16" if CUDA_AVAILABLE else "int8"
+
+# Segmenti vocali decodificati insieme in un forward pass (solo faster-whisper)
+TRANSCRIBE_BATCH_SIZE = 8
+
+# Thread dell'encoder FFmpeg: metà dei core, l'altra metà resta a Whisper
+FFMPEG_THREADS = max(1, (os.cpu_count() or 4) // 2)
+
+# Byte minimi scritti da FFmpeg su file prima di considerare lo stream avviato
+MIN_HEADER_BYTES = 4096
+
 
 class VLCSpeechToText:
-    def __init__(self, model_size="base", language="it"):
+    def __init__(self, model_size="base", language="it", use_faster_whisper=False, num_workers=1):
         """
         Inizializza il sistema di speech-to-text.
         
         Args:
             model_size: Dimensione del modello Whisper (tiny, base, small, medium, large)
             language: Codice lingua (it per italiano, en per inglese, etc.)
+            use_faster_whisper: Usa faster-whisper (se installato) per transcribe_chunk
+            num_workers: Trascrizioni concorrenti eseguite davvero in parallelo da
+                faster-whisper (CTranslate2 serializza le chiamate oltre questo numero)
         """
         self.model_size = model_size
         self.language = language
         self.model = None
+        self.batched_model = None  # Pipeline batched di faster-whisper
+        self.use_faster_whisper = use_faster_whisper and FASTER_WHISPER_AVAILABLE
+        self.num_workers = max(1, num_workers)
         self.audio_queue = queue.Queue()
         self.running = False
+        # Il decoder di openai-whisper installa hook sul modello durante la
+        # trascrizione: chiamate concorrenti sulla stessa istanza vanno serializzate
+        self._transcribe_lock = threading.Lock()
         
     def load_model(self):
         """Carica il modello Whisper."""
-        print(f"Caricamento modello Whisper ({self.model_size})...")
-        self.model = whisper.load_model(self.model_size)
-        print("Modello caricato!")
+        if self.use_faster_whisper:
+            print(f"Caricamento modello faster-whisper ({self.model_size})...")
+            # Un worker CTranslate2 per trascrizione concorrente, con i core divisi
+            # tra i worker invece di lasciare a ciascuno tutti i thread OMP
+            self.batched_model = BatchedInferencePipeline(model=WhisperModel(
+                self.model_size,
+                device=DEVICE,
+                compute_type=FASTER_WHISPER_COMPUTE_TYPE,
+                num_workers=self.num_workers,
+                cpu_threads=max(1, (os.cpu_count() or 1) // self.num_workers)
+            ))
+        else:
+            print(f"Caricamento modello Whisper ({self.model_size})...")
+            self.model = whisper.load_model(self.model_size, device=DEVICE)
+        print(f"Modello caricato! ({DEVICE})")
+    
+    def transcribe_chunk(self, audio, language=None):
+        """
+        Trascrive un chunk audio e ritorna il testo.
+        
+        Con faster-whisper i segmenti vocali del chunk (individuati dal VAD) vengono
+        decodificati insieme in batch con i kernel CTranslate2.
+        
+        Args:
+            audio: Percorso file audio o array float32 a 16 kHz
+            language: Codice lingua (None per rilevamento automatico)
+        """
+        if self.batched_model is not None:
+            segments, _ = self.batched_model.transcribe(
+                audio,
+                language=language,
+                batch_size=TRANSCRIBE_BATCH_SIZE
+            )
+            return "".join(segment.text for segment in segments).strip()
+        
+        with self._transcribe_lock:
+            result = self.model.transcribe(
+                audio,
+                language=language,
+                task="transcribe",
+                fp16=USE_FP16
+            )
+        return result["text"].strip()
+    
+    def transcribe_words(self, audio, language=None):
+        """
+        Trascrive un chunk audio e ritorna le parole con i rispettivi timestamp,
+        come lista di tuple (inizio, fine, parola) in secondi dall'inizio del chunk.
+        """
+        if self.batched_model is not None:
+            # Audio breve: il modello sottostante evita l'overhead del batching
+            segments, _ = self.batched_model.model.transcribe(
+                audio,
+                language=language,
+                word_timestamps=True,
+                condition_on_previous_text=False
+            )
+            return [(w.start, w.end, w.word) for s in segments for w in (s.words or [])]
+        
+        with self._transcribe_lock:
+            result = self.model.transcribe(
+                audio,
+                language=language,
+                task="transcribe",
+                fp16=USE_FP16,
+                word_timestamps=True,
+                condition_on_previous_text=False
+            )
+        return [
+            (w["start"], w["end"], w["word"])
+            for s in result["segments"] for w in s.get("words", [])
+        ]
         
     def transcribe_audio(self, audio_path):
         """Trascrive un file audio."""
@@ -117,7 +221,7 @@ class VLCSpeechToText:
                         tmp_path,
                         language=self.language,
                         task="transcribe",
-                        fp16=False
+                        fp16=USE_FP16
                     )
                     
                     text = result["text"].strip()
@@ -247,13 +351,72 @@ def update_vlc_subtitles(vlc_port=8080, srt_path=None):
         return False
 
 
+# Encoder H.264 hardware in ordine di preferenza, con le opzioni a bassa latenza
+HW_H264_ENCODERS = [
+    ("h264_nvenc", ["-preset", "p1", "-tune", "ll"]),
+]
+if sys.platform == 'darwin':
+    HW_H264_ENCODERS.append(("h264_videotoolbox", ["-realtime", "1"]))
+
+
+@lru_cache(maxsize=None)
+def detect_hw_h264_encoder():
+    """
+    Ritorna (encoder, opzioni) del primo encoder H.264 hardware utilizzabile,
+    o None. Il risultato è calcolato una volta per processo: oltre a controllare
+    `ffmpeg -encoders`, codifica pochi frame di prova perché un encoder può essere
+    compilato in FFmpeg senza che sia presente l'hardware (es. NVENC senza GPU).
+    """
+    try:
+        encoders = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            timeout=10
+        ).stdout.decode(errors='ignore')
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    
+    for encoder, options in HW_H264_ENCODERS:
+        if encoder not in encoders:
+            continue
+        try:
+            probe = subprocess.run(
+                ["ffmpeg", "-hide_banner", "-v", "error",
+                 "-f", "lavfi", "-i", "nullsrc=s=256x256:d=0.2",
+                 "-c:v", encoder, "-f", "null", "-"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=10
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            continue
+        if probe.returncode == 0:
+            return encoder, options
+    return None
+
+
+def h264_encoder_args(software_args):
+    """
+    Argomenti encoder video: l'encoder hardware se disponibile (libera la CPU
+    per Whisper), altrimenti gli argomenti libx264 passati.
+    """
+    hw = detect_hw_h264_encoder()
+    if hw is None:
+        return list(software_args)
+    encoder, options = hw
+    return ["-c:v", encoder] + options
+
+
 def restart_ffmpeg_video_process(
     input_source,
     srt_path,
     output_path=None,
     use_http=False,
     http_port=8090,
-    hls_output_dir=None
+    hls_output_dir=None,
+    audio_output_args=None,
+    threads=None
 ):
     """
     Riavvia FFmpeg per processare video con sottotitoli burn-in aggiornati.
@@ -264,6 +427,12 @@ def restart_ffmpeg_video_process(
         output_path: Percorso output (pipe, file, o None per stdout)
         use_http: Se True, usa HTTP streaming invece di pipe
         http_port: Porta HTTP se use_http=True
+        hls_output_dir: Directory di output HLS (None per non usare HLS)
+        audio_output_args: Argomenti di un secondo output solo audio (es. chunk WAV
+            per Whisper) ricavato dallo stesso input, così la sorgente viene letta
+            e decodificata una sola volta
+        threads: Thread di codifica per questo processo (default FFMPEG_THREADS);
+            con più sessioni concorrenti va diviso tra i processi FFmpeg
     """
     # Escape del percorso SRT per il filtro subtitles
     # Su macOS, potrebbe essere necessario usare percorsi assoluti
@@ -299,17 +468,21 @@ def restart_ffmpeg_video_process(
     
     ffmpeg_cmd = [
         "ffmpeg",
+        "-nostdin",  # Non legge dal terminale (lanciato da thread del server)
         "-i", input_source,
         "-vf", f"subtitles={abs_srt_path}:force_style='FontSize=24,PrimaryColour=&Hffffff,OutlineColour=&H000000,Outline=2,Bold=1'",
-        "-c:v", "libx264",
-        "-preset", "medium",  # Cambiato da ultrafast a medium per migliore qualità
-        "-crf", "23",  # Qualità video (18-28, più basso = migliore qualità)
-        "-profile:v", "baseline",  # Profilo baseline per massima compatibilità
-        "-level", "3.1",  # Aumentato per supportare risoluzioni più alte
+        *h264_encoder_args([
+            "-c:v", "libx264",
+            "-preset", "medium",  # Cambiato da ultrafast a medium per migliore qualità
+            "-crf", "23",  # Qualità video (18-28, più basso = migliore qualità)
+            "-profile:v", "baseline",  # Profilo baseline per massima compatibilità
+            "-level", "3.1",  # Aumentato per supportare risoluzioni più alte
+        ]),
         "-pix_fmt", "yuv420p",  # Formato pixel standard
         "-g", "30",  # GOP size (keyframe ogni 30 frame)
         "-keyint_min", "30",
         "-sc_threshold", "0",
+        "-threads", str(threads or FFMPEG_THREADS),
         "-c:a", "aac",
         "-b:a", "128k",  # Bitrate audio fisso
         "-ar", "44100",  # Sample rate standard
@@ -356,6 +529,10 @@ def restart_ffmpeg_video_process(
         # Output su stdout (per pipe diretta)
         ffmpeg_cmd.append("-")
     
+    if audio_output_args:
+        # Secondo output: FFmpeg seleziona automaticamente la traccia audio
+        ffmpeg_cmd.extend(audio_output_args)
+    
     # Configura process creation per evitare semafori leaked
     import multiprocessing
     # Usa spawn invece di fork su macOS per evitare problemi con semafori
@@ -375,6 +552,30 @@ def restart_ffmpeg_video_process(
         )
 
 
+def wait_for_ffmpeg_output(process, output_path, timeout=5.0, min_bytes=MIN_HEADER_BYTES):
+    """
+    Attende che FFmpeg inizi a scrivere l'output invece di dormire un tempo fisso.
+    
+    Ritorna appena il file di output contiene almeno min_bytes, oppure subito se
+    l'output è una named pipe (FFmpeg resta bloccato finché il lettore non la apre).
+    
+    Returns:
+        True se FFmpeg è ancora in esecuzione, False se è terminato
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            st = os.stat(output_path)
+            if stat.S_ISFIFO(st.st_mode) or st.st_size >= min_bytes:
+                break
+        except OSError:
+            pass
+        time.sleep(0.05)
+    return process.poll() is None
+
+
 def launch_vlc_with_subtitles(input_source, model_size="base", language="it", 
                              chunk_duration=10, vlc_path="vlc"):
     """
@@ -429,7 +630,6 @@ def launch_vlc_with_subtitles(input_source, model_size="base", language="it",
         print("  Installa ffplay: ffplay è incluso con FFmpeg")
     
     # Usa una named pipe per lo streaming (funziona meglio con ffplay)
-    import stat
     video_pipe_path = os.path.join(tempfile.gettempdir(), f"ffmpeg_playback_{os.getpid()}.ts")
     
     # Crea una named pipe per lo streaming real-time
@@ -457,7 +657,7 @@ def launch_vlc_with_subtitles(input_source, model_size="base", language="it",
     )
     
     # Aspetta che FFmpeg inizi a generare lo stream
-    time.sleep(2)
+    wait_for_ffmpeg_output(ffmpeg_video_process, video_pipe_path)
     
     # Avvia il player (ffplay o VLC)
     if use_ffplay:
@@ -555,15 +755,19 @@ def launch_vlc_with_subtitles(input_source, model_size="base", language="it",
         print("FFmpeg verrà riavviato periodicamente per applicare i nuovi sottotitoli\n")
         
         while player_process.poll() is None or ffmpeg_process.poll() is None:
-            # Cerca nuovi chunk
+            # Cerca nuovi chunk: una sola lettura della directory per iterazione
+            entries = {e.name: e for e in os.scandir(chunk_dir)}
             for i in range(chunk_counter, chunk_counter + 10):
-                chunk_file = os.path.join(chunk_dir, f"chunk_{i:04d}.wav")
+                entry = entries.get(f"chunk_{i:04d}.wav")
+                if entry is None:
+                    continue
+                chunk_file = entry.path
                 
-                if os.path.exists(chunk_file) and chunk_file not in processed_chunks:
+                if chunk_file not in processed_chunks:
                     processed_chunks.add(chunk_file)
                     time.sleep(0.5)  # Aspetta che il file sia completo
                     
-                    if os.path.getsize(chunk_file) == 0:
+                    if entry.stat().st_size == 0:  # stat dopo l'attesa: dimensione aggiornata
                         continue
                     
                     # Calcola timestamp basati sui chunk
@@ -579,7 +783,7 @@ def launch_vlc_with_subtitles(input_source, model_size="base", language="it",
                             chunk_file,
                             language=language,
                             task="transcribe",
-                            fp16=False
+                            fp16=USE_FP16
                         )
                         transcribe_time = time.time() - transcribe_start
                         
@@ -590,20 +794,27 @@ def launch_vlc_with_subtitles(input_source, model_size="base", language="it",
                                 'index': subtitle_index,
                                 'start': chunk_start_time,
                                 'end': chunk_end_time,
+                                # Timestamp SRT formattati una sola volta, riusati ad ogni riscrittura
+                                'start_str': format_srt_time(chunk_start_time),
+                                'end_str': format_srt_time(chunk_end_time),
                                 'text': text
                             }
                             all_subtitles.append(subtitle)
                             
                             # Aggiorna file SRT
-                            with open(srt_path, 'w', encoding='utf-8') as f:
-                                for sub in all_subtitles:
-                                    f.write(f"{sub['index']}\n")
-                                    f.write(f"{format_srt_time(sub['start'])} --> {format_srt_time(sub['end'])}\n")
-                                    f.write(f"{sub['text']}\n\n")
+                            # Serializza tutto in memoria e scrive con una sola write()
+                            payload = b"".join(
+                                f"{sub['index']}\n"
+                                f"{sub['start_str']} --> {sub['end_str']}\n"
+                                f"{sub['text']}\n\n".encode('utf-8')
+                                for sub in all_subtitles
+                            )
+                            with open(srt_path, 'wb') as f:
+                                f.write(payload)
                             
                             # Debug: mostra informazioni sul sottotitolo
                             print(f"✓ ({transcribe_time:.1f}s) - {text[:50]}...")
-                            print(f"   Timestamp: {format_srt_time(chunk_start_time)} --> {format_srt_time(chunk_end_time)}")
+                            print(f"   Timestamp: {subtitle['start_str']} --> {subtitle['end_str']}")
                             
                             # Riavvia FFmpeg ogni 3-5 sottotitoli per applicare i nuovi sottotitoli burn-in
                             # Questo è necessario perché FFmpeg non ricarica automaticamente il file SRT
@@ -736,8 +947,6 @@ def launch_ffplay_with_subtitles(input_source, model_size="base", language="it",
     
     # Pipeline: FFmpeg processa video con sottotitoli burn-in -> ffplay riproduce
     # Usa una named pipe (FIFO) per lo streaming in tempo reale
-    import stat
-    
     video_pipe_path = os.path.join(tempfile.gettempdir(), f"ffplay_subtitles_{os.getpid()}.ts")
     
     # Crea una named pipe per lo streaming real-time
@@ -757,17 +966,35 @@ def launch_ffplay_with_subtitles(input_source, model_size="base", language="it",
     print(f"Chunk: {chunk_duration} secondi")
     print(f"I sottotitoli verranno incorporati direttamente nel video\n")
     
+    chunk_dir = tempfile.mkdtemp(prefix="whisper_chunks_")
+    chunk_pattern = os.path.join(chunk_dir, "chunk_%04d.wav")
+    
     # Avvia FFmpeg per processare video con sottotitoli burn-in
-    # FFmpeg scrive su una pipe che ffplay leggerà
+    # FFmpeg scrive su una pipe che ffplay leggerà; qui FFmpeg non viene mai
+    # riavviato, quindi lo stesso processo estrae anche i chunk audio e la
+    # sorgente viene letta e decodificata una sola volta
     print("Avvio FFmpeg per processare video con sottotitoli burn-in...")
     ffmpeg_video_process = restart_ffmpeg_video_process(
         input_source,
         srt_path,
-        video_pipe_path
+        video_pipe_path,
+        audio_output_args=[
+            "-vn",
+            "-acodec", "pcm_s16le",
+            "-ar", "16000",
+            "-ac", "1",
+            "-f", "segment",
+            "-segment_time", str(chunk_duration),
+            "-segment_format", "wav",
+            "-reset_timestamps", "1",
+            "-strftime", "0",
+            "-y",
+            chunk_pattern
+        ]
     )
     
     # Aspetta che FFmpeg inizi a generare lo stream
-    time.sleep(2)
+    wait_for_ffmpeg_output(ffmpeg_video_process, video_pipe_path)
     
     # Avvia ffplay per riprodurre lo stream processato
     ffplay_cmd = [
@@ -786,40 +1013,15 @@ def launch_ffplay_with_subtitles(input_source, model_size="base", language="it",
         stderr=subprocess.PIPE
     )
     
-    # Aspetta che ffplay si avvii
-    time.sleep(2)
-    
     print("✓ Pipeline attiva: FFmpeg -> ffplay\n")
     
     # Inizia a processare l'audio in parallelo
-    chunk_dir = tempfile.mkdtemp(prefix="whisper_chunks_")
-    chunk_pattern = os.path.join(chunk_dir, "chunk_%04d.wav")
     chunk_counter = 0
     subtitle_index = 1
     vlc_start_time = time.time()  # Tempo di avvio VLC
     
-    # Avvia FFmpeg per estrarre audio chunk in parallelo
-    ffmpeg_cmd = [
-        "ffmpeg",
-        "-i", input_source,
-        "-vn",
-        "-acodec", "pcm_s16le",
-        "-ar", "16000",
-        "-ac", "1",
-        "-f", "segment",
-        "-segment_time", str(chunk_duration),
-        "-segment_format", "wav",
-        "-reset_timestamps", "1",
-        "-strftime", "0",
-        "-y",
-        chunk_pattern
-    ]
-    
-    ffmpeg_process = subprocess.Popen(
-        ffmpeg_cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
+    # I chunk audio sono prodotti dallo stesso processo FFmpeg del video
+    ffmpeg_process = ffmpeg_video_process
     
     processed_chunks = set()
     all_subtitles = []  # Accumula tutti i sottotitoli
@@ -829,15 +1031,19 @@ def launch_ffplay_with_subtitles(input_source, model_size="base", language="it",
         print("Processamento audio e generazione sottotitoli burn-in in tempo reale...\n")
         
         while ffplay_process.poll() is None or ffmpeg_process.poll() is None:
-            # Cerca nuovi chunk
+            # Cerca nuovi chunk: una sola lettura della directory per iterazione
+            entries = {e.name: e for e in os.scandir(chunk_dir)}
             for i in range(chunk_counter, chunk_counter + 10):
-                chunk_file = os.path.join(chunk_dir, f"chunk_{i:04d}.wav")
+                entry = entries.get(f"chunk_{i:04d}.wav")
+                if entry is None:
+                    continue
+                chunk_file = entry.path
                 
-                if os.path.exists(chunk_file) and chunk_file not in processed_chunks:
+                if chunk_file not in processed_chunks:
                     processed_chunks.add(chunk_file)
                     time.sleep(0.5)  # Aspetta che il file sia completo
                     
-                    if os.path.getsize(chunk_file) == 0:
+                    if entry.stat().st_size == 0:  # stat dopo l'attesa: dimensione aggiornata
                         continue
                     
                     # Calcola timestamp basato sul tempo di riproduzione
@@ -853,7 +1059,7 @@ def launch_ffplay_with_subtitles(input_source, model_size="base", language="it",
                             chunk_file,
                             language=language,
                             task="transcribe",
-                            fp16=False
+                            fp16=USE_FP16
                         )
                         transcribe_time = time.time() - transcribe_start
                         
@@ -864,16 +1070,23 @@ def launch_ffplay_with_subtitles(input_source, model_size="base", language="it",
                                 'index': subtitle_index,
                                 'start': chunk_start_time,
                                 'end': chunk_end_time,
+                                # Timestamp SRT formattati una sola volta, riusati ad ogni riscrittura
+                                'start_str': format_srt_time(chunk_start_time),
+                                'end_str': format_srt_time(chunk_end_time),
                                 'text': text
                             }
                             all_subtitles.append(subtitle)
                             
                             # Aggiorna file SRT (scrive tutto il file ogni volta)
-                            with open(srt_path, 'w', encoding='utf-8') as f:
-                                for sub in all_subtitles:
-                                    f.write(f"{sub['index']}\n")
-                                    f.write(f"{format_srt_time(sub['start'])} --> {format_srt_time(sub['end'])}\n")
-                                    f.write(f"{sub['text']}\n\n")
+                            # Serializza tutto in memoria e scrive con una sola write()
+                            payload = b"".join(
+                                f"{sub['index']}\n"
+                                f"{sub['start_str']} --> {sub['end_str']}\n"
+                                f"{sub['text']}\n\n".encode('utf-8')
+                                for sub in all_subtitles
+                            )
+                            with open(srt_path, 'wb') as f:
+                                f.write(payload)
                             
                             print(f"✓ ({transcribe_time:.1f}s) - {text[:50]}...")
                             
@@ -1025,18 +1238,22 @@ def process_live_stream(input_source, model_size="base", language="it",
                 ffmpeg_process.terminate()
                 break
             
-            # Cerca nuovi chunk
+            # Cerca nuovi chunk: una sola lettura della directory per iterazione
+            entries = {e.name: e for e in os.scandir(chunk_dir)}
             for i in range(chunk_counter, chunk_counter + 10):  # Controlla prossimi 10 chunk
-                chunk_file = os.path.join(chunk_dir, f"chunk_{i:04d}.wav")
+                entry = entries.get(f"chunk_{i:04d}.wav")
+                if entry is None:
+                    continue
+                chunk_file = entry.path
                 
-                if os.path.exists(chunk_file) and chunk_file not in processed_chunks:
+                if chunk_file not in processed_chunks:
                     # Nuovo chunk trovato
                     processed_chunks.add(chunk_file)
                     
                     # Aspetta che il file sia completo (non più in scrittura)
                     time.sleep(0.5)
                     
-                    if os.path.getsize(chunk_file) == 0:
+                    if entry.stat().st_size == 0:  # stat dopo l'attesa: dimensione aggiornata
                         continue
                     
                     print(f"[Chunk {i}] Trascrizione...", end=" ", flush=True)
@@ -1048,7 +1265,7 @@ def process_live_stream(input_source, model_size="base", language="it",
                             chunk_file,
                             language=language,
                             task="transcribe",
-                            fp16=False
+                            fp16=USE_FP16
                         )
                         transcribe_time = time.time() - transcribe_start
                         
@@ -5,16 +5,44 @@ Accessibile da remoto per inserire URL video e riprodurlo con sottotitoli.
 """
 
 import os
+
+# GEVENT=1: una greenlet per connessione invece di un thread del sistema
+# operativo per ogni stream. Il patch deve precedere tutti gli altri import.
+# I thread restano nativi: la trascrizione è CPU-bound e bloccherebbe il loop,
+# e i subprocess FFmpeg sono gestiti anche da thread diversi dal principale.
+USE_GEVENT = os.environ.get('GEVENT') == '1'
+if USE_GEVENT:
+    try:
+        from gevent import monkey
+        monkey.patch_all(thread=False, subprocess=False)
+        from gevent.pywsgi import WSGIServer
+    except ImportError:
+        USE_GEVENT = False
+
 import sys
+import argparse
+import signal
 import subprocess
 import tempfile
 import threading
 import time
 import json
+import stat
+import selectors
+import mmap
+import hashlib
+import re
+import queue
+import atexit
+import logging
+import logging.handlers
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import shutil
-from flask import Flask, render_template, request, jsonify, Response, stream_with_context, send_file
+from flask import Flask, render_template, request, Response, stream_with_context, send_file
 from flask_cors import CORS
+import numpy as np
 
 # Import fcntl solo su sistemi Unix (non Windows)
 try:
@@ -23,6 +51,43 @@ try:
 except ImportError:
     HAS_FCNTL = False
 
+# Logging: i thread delle richieste accodano solo il record, la scrittura su
+# stderr avviene nel thread del QueueListener fuori dal percorso critico
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_queue = queue.Queue(-1)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
+# Logger dello streaming: i messaggi di debug del ciclo di lettura costano solo
+# un controllo di livello finché non si abilita DEBUG
+stream_log = logger.getChild('stream')
+
+# waitress è opzionale: se non installato si usa il server di sviluppo di Flask
+try:
+    from waitress import serve as waitress_serve
+    HAS_WAITRESS = True
+except ImportError:
+    HAS_WAITRESS = False
+
+# watchdog è opzionale: notifiche di modifica file (inotify/kqueue/FSEvents)
+# invece del polling periodico
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    HAS_WATCHDOG = True
+except ImportError:
+    HAS_WATCHDOG = False
+
+# orjson è opzionale: serializzazione JSON in C per le API interrogate di continuo
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
 # Aggiungi il percorso dello script principale
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
@@ -31,12 +96,20 @@ try:
         VLCSpeechToText,
         format_srt_time,
         restart_ffmpeg_video_process,
-        is_url
+        wait_for_ffmpeg_output,
+        is_url,
+        h264_encoder_args,
+        FFMPEG_THREADS,
+        FASTER_WHISPER_AVAILABLE
     )
+    import torch
 except ImportError:
     print("Errore: Impossibile importare vlc_speech2text. Assicurati che il file esista.")
     sys.exit(1)
 
+# Il decoder Whisper usa i core non assegnati all'encoder FFmpeg
+torch.set_num_threads(max(1, (os.cpu_count() or 2) - FFMPEG_THREADS))
+
 try:
     from ffmpeg_whisper import (
         check_ffmpeg_whisper_support,
@@ -68,32 +141,617 @@ def has_ffmpeg_whisper():
 template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
 app = Flask(__name__, template_folder=template_dir)
 CORS(app)  # Permette accesso da remoto
+# Disabilita la cache dei file serviti (playlist e segmenti HLS cambiano di continuo)
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+# Dietro un proxy con X-Sendfile (Apache mod_xsendfile, lighttpd) send_file
+# risponde solo con l'header e il proxy invia il file con sendfile(2)
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
+class ShardedSessions:
+    """
+    Registro delle sessioni suddiviso in shard, ognuno con il proprio lock.
+    
+    Richieste concorrenti su sessioni diverse acquisiscono lock diversi invece di
+    serializzarsi tutte sullo stesso dizionario globale. Le letture (get, in)
+    non acquisiscono lock: una singola operazione su dict è atomica in CPython
+    (e protetta internamente nelle build free-threaded), i lock servono solo a
+    rendere consistenti le mutazioni composte.
+    
+    Il registro è limitato: oltre max_size sessioni viene rimossa quella usata
+    meno di recente, e le sessioni non accedute da più di ttl secondi vengono
+    rimosse da un thread di pulizia. Le sessioni rimosse sono passate a on_evict
+    in un thread dedicato, fuori dal percorso delle richieste.
+    """
+    
+    def __init__(self, n=16, max_size=None, ttl=None, on_evict=None):
+        # n deve essere una potenza di 2 (lo shard si ricava con una maschera)
+        self._mask = n - 1
+        self._shards = [({}, threading.Lock()) for _ in range(n)]
+        self.max_size = max_size
+        self.ttl = ttl
+        self._on_evict = on_evict
+        self._evicted = queue.Queue()
+        
+        if on_evict is not None:
+            threading.Thread(target=self._cleaner_loop, daemon=True).start()
+        if ttl:
+            threading.Thread(target=self._reaper_loop, daemon=True).start()
+    
+    def _shard(self, session_id):
+        return self._shards[hash(session_id) & self._mask]
+    
+    def get(self, session_id, default=None):
+        session = self._shard(session_id)[0].get(session_id)
+        if session is None:
+            return default
+        session.last_access = time.monotonic()
+        return session
+    
+    def pop(self, session_id, default=None):
+        shard, lock = self._shard(session_id)
+        with lock:
+            return shard.pop(session_id, default)
+    
+    def __setitem__(self, session_id, session):
+        session.last_access = time.monotonic()
+        shard, lock = self._shard(session_id)
+        with lock:
+            shard[session_id] = session
+        if self.max_size and len(self) > self.max_size:
+            self._evict_lru()
+    
+    def __contains__(self, session_id):
+        return session_id in self._shard(session_id)[0]
+    
+    def __len__(self):
+        return sum(len(shard) for shard, _ in self._shards)
+    
+    def items(self):
+        """Snapshot (session_id, sessione), ogni shard copiato sotto il proprio lock."""
+        result = []
+        for shard, lock in self._shards:
+            with lock:
+                result.extend(shard.items())
+        return result
+    
+    def popitem(self):
+        """Rimuove e ritorna una coppia (session_id, sessione); KeyError se vuoto."""
+        for shard, lock in self._shards:
+            with lock:
+                if shard:
+                    return shard.popitem()
+        raise KeyError('popitem(): registro sessioni vuoto')
+    
+    def clear(self):
+        for shard, lock in self._shards:
+            with lock:
+                shard.clear()
+    
+    def _evict(self, session_id, session, reason):
+        """Rimuove la sessione (se è ancora registrata) e ne accoda il cleanup."""
+        shard, lock = self._shard(session_id)
+        with lock:
+            if shard.get(session_id) is not session:
+                return
+            del shard[session_id]
+        logger.info("Sessione %s rimossa dal registro (%s)", session_id, reason)
+        if self._on_evict is not None:
+            self._evicted.put((session_id, session))
+    
+    def _evict_lru(self):
+        while len(self) > self.max_size:
+            items = self.items()
+            if not items:
+                return
+            session_id, session = min(items, key=lambda item: item[1].last_access)
+            self._evict(session_id, session, "limite sessioni")
+    
+    def _reaper_loop(self):
+        while True:
+            time.sleep(self.ttl / 10)
+            expired_before = time.monotonic() - self.ttl
+            for session_id, session in self.items():
+                if session.last_access < expired_before:
+                    self._evict(session_id, session, "scaduta")
+    
+    def _cleaner_loop(self):
+        while True:
+            self._on_evict(self._evicted.get())
+
+
+def _safe_cleanup(item):
+    """Pulisce una sessione (session_id, sessione) senza propagare eccezioni."""
+    session_id, session = item
+    try:
+        return session.cleanup()
+    except Exception:
+        logger.exception("Errore cleanup sessione %s", session_id)
+        return False
+
+
+# Corpi JSON precalcolati per le risposte più frequenti. La Response viene
+# comunque creata per ogni richiesta: flask-cors aggiunge header alla risposta,
+# quindi un'istanza condivisa li accumulerebbe tra una richiesta e l'altra.
+_NOT_FOUND_BODY = b'{"error": "Sessione non trovata"}'
+_STOPPED_BODY = b'{"status": "stopped"}'
+_CLEANED_BODY = b'{"status": "cleaned"}'
+_ALREADY_CLEANED_BODY = b'{"status": "already_cleaned"}'
+
+
+def _json_bytes_response(body, status=200):
+    """Risposta JSON da un corpo già serializzato, senza passare da jsonify."""
+    return Response(body, status=status, mimetype='application/json')
+
+
+def json_dumps_bytes(obj, indent=False):
+    """Serializza in JSON (bytes UTF-8), con orjson se installato."""
+    if HAS_ORJSON:
+        option = orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, indent=2 if indent else None).encode('utf-8')
+
+
+def json_response(obj, status=200):
+    """Equivalente di jsonify serializzato con json_dumps_bytes."""
+    return _json_bytes_response(json_dumps_bytes(obj), status)
+
+
+# Limiti del registro sessioni (configurabili da environment)
+MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 256))
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 3600))  # secondi dall'ultimo accesso
 
 # Stato globale per le sessioni
-sessions = {}
+sessions = ShardedSessions(max_size=MAX_SESSIONS, ttl=SESSION_TTL, on_evict=_safe_cleanup)
 session_counter = 0
 
 # Directory per file temporanei
 TEMP_DIR = tempfile.gettempdir()
+# Directory dei segmenti HLS. Un tmpfs (es. HLS_ROOT=/dev/shm) evita l'I/O su disco,
+# ma la playlist tiene tutti i segmenti della sessione: va scelto solo se la RAM
+# basta per l'intero video transcodificato di ogni sessione attiva (in Docker
+# /dev/shm è di 64 MB), quindi non è il default. Di default una sottodirectory
+# dedicata della directory temporanea, così la pulizia delle directory orfane non
+# tocca file di altri programmi
+HLS_ROOT = os.environ.get('HLS_ROOT') or os.path.join(TEMP_DIR, 'vls_hls')
+os.makedirs(HLS_ROOT, exist_ok=True)
+# Prefisso delle directory HLS delle sessioni: l'unico che evict_stale_hls_dirs rimuove
+HLS_DIR_PREFIX = 'hls_session_'
+# Dietro nginx i file HLS possono essere inviati da nginx stesso (sendfile) tramite
+# X-Accel-Redirect verso una location interna con alias su HLS_ROOT
+USE_X_ACCEL = os.environ.get('USE_X_ACCEL') == '1'
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/_hls_internal').rstrip('/')
+HLS_STALE_AGE = 300  # Secondi dopo cui una directory HLS orfana viene rimossa
+
+# Chunk audio trascritti in parallelo solo con faster-whisper: il modello è creato
+# con num_workers=TRANSCRIBE_WORKERS, quindi CTranslate2 esegue davvero in parallelo
+# altrettante chiamate concorrenti. openai-whisper installa hook di kv-cache
+# sul modulo condiviso a ogni decodifica, quindi lì le trascrizioni sono serializzate
+# e un worker solo evita thread fermi sul lock del modello
+if FASTER_WHISPER_AVAILABLE:
+    TRANSCRIBE_WORKERS = max(1, min((os.cpu_count() or 2) // 2, 4))
+else:
+    TRANSCRIBE_WORKERS = 1
+
+# Sessioni pulite in parallelo da /api/cleanup/all e allo shutdown
+CLEANUP_WORKERS = 16
+
+# Blocco SRT: indice, timestamp inizio/fine, testo (fino al blocco successivo)
+_SRT_BLOCK_RE = re.compile(
+    rb'(\d+)\s+(\d{2}):(\d{2}):(\d{2}),(\d{3})\s+-->\s+(\d{2}):(\d{2}):(\d{2}),(\d{3})\s+(.+?)(?=\n\d+\s+\d{2}:|\Z)',
+    re.DOTALL
+)
+SAMPLE_RATE = 16000  # Hz, frequenza attesa da Whisper
+SILENCE_RMS_THRESHOLD = 0.01  # RMS (fondo scala 1.0) sotto cui un chunk è silenzio
+# Riavvio FFmpeg (solo MP4) per applicare nuovi sottotitoli: al più ogni N
+# sottotitoli o ogni N secondi, il primo dei due
+RESTART_EVERY_SUBS = 10
+RESTART_INTERVAL = 30
+# Intervallo (secondi) delle ipotesi parziali sul chunk in corso (partial_results)
+PARTIAL_STEP = 2
+# Con HLS l'SRT è scritto al più ogni N secondi (pari a hls_time)
+SRT_FLUSH_INTERVAL = 2
+# stderr FFmpeg conservato per la diagnostica: al più N blocchi da STDERR_READ_SIZE
+STDERR_RING_CHUNKS = 64
+STDERR_READ_SIZE = 4096
+# Validità (secondi) dei dati della pagina di debug
+DEBUG_CACHE_TTL = 0.5
+# Memo delle chiamate os.stat ripetute: durata (secondi) e numero massimo di voci
+STAT_CACHE_TTL = 0.1
+STAT_CACHE_MAX = 1024
+# Dimensione del buffer delle pipe lette dal server (limite default non privilegiato di Linux)
+PIPE_BUFFER_SIZE = 1024 * 1024
+# Lettura massima per syscall nello streaming MP4 (pari alla capacità della pipe)
+STREAM_READ_SIZE = PIPE_BUFFER_SIZE
+
+
+def enlarge_pipe_buffer(fd, size=PIPE_BUFFER_SIZE):
+    """
+    Su Linux aumenta la capacità di una pipe/FIFO (default 64KB): FFmpeg si blocca
+    meno spesso in scrittura e ogni read restituisce più dati, riducendo il numero
+    di syscall e di risvegli per byte trasferito. No-op su file regolari e altri OS.
+    """
+    if HAS_FCNTL and hasattr(fcntl, 'F_SETPIPE_SZ'):
+        try:
+            fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, size)
+        except OSError:
+            pass
+
+
+def advise_sequential(fd):
+    """
+    Dichiara al kernel una lettura sequenziale del file: il readahead raddoppia
+    e le letture successive trovano già i dati in page cache. No-op su pipe
+    (ESPIPE) e sui sistemi senza posix_fadvise.
+    """
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def send_file_sequential(path, **kwargs):
+    """send_file con advise_sequential sul file aperto dal file_wrapper WSGI."""
+    response = send_file(path, **kwargs)
+    wrapped = getattr(response.response, 'file', None)
+    if wrapped is not None and hasattr(wrapped, 'fileno'):
+        advise_sequential(wrapped.fileno())
+    return response
+
+
+def terminate_processes(processes, timeout=3):
+    """
+    Termina un gruppo di subprocess: invia SIGTERM a tutti, li attende con una
+    scadenza comune passando a SIGKILL per chi non esce, e solo alla fine chiude
+    le pipe. Il tempo massimo è timeout indipendentemente dal numero di processi.
+    
+    Le pipe non vanno chiuse prima: BufferedReader.close() attende la readinto in
+    corso nel thread che legge il PCM, che si sblocca solo a processo terminato (EOF).
+    """
+    for process in processes:
+        try:
+            process.terminate()
+        except OSError:
+            pass
+    
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        try:
+            process.wait(timeout=max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            # Se non termina, forza kill
+            process.kill()
+            try:
+                process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                logger.error("Processo FFmpeg %s non terminato dopo SIGKILL", process.pid)
+        except Exception as e:
+            logger.error("Errore terminazione processo FFmpeg: %s", e)
+    
+    for process in processes:
+        if process.poll() is None:
+            continue  # Ancora vivo: chiudere le pipe potrebbe bloccare sul lettore
+        for pipe in (process.stdin, process.stdout, process.stderr):
+            if pipe:
+                try:
+                    pipe.close()
+                except Exception:
+                    pass
+
+
+def is_silent(audio, threshold=SILENCE_RMS_THRESHOLD):
+    """True se l'energia RMS del segnale (senza componente continua) è sotto soglia."""
+    if audio.size == 0:
+        return True
+    dc = audio - audio.mean()
+    return float(np.dot(dc, dc)) / dc.size < threshold * threshold
+
+
+_observer = None
+_observer_lock = threading.Lock()
+
+
+def _get_observer():
+    """Observer watchdog condiviso da tutte le sessioni (un solo thread)."""
+    global _observer
+    with _observer_lock:
+        if _observer is None:
+            _observer = Observer()
+            _observer.daemon = True
+            _observer.start()
+        return _observer
+
+
+# Un solo watch per directory, mai rimosso: watchdog identifica i watch per
+# (percorso, ricorsivo), quindi l'unschedule di un notifier toglierebbe gli
+# handler di tutti gli altri sulla stessa directory. Il dispatcher inoltra
+# gli eventi ai notifier registrati sul percorso
+_watch_targets = {}  # percorso assoluto -> set di Event dei notifier
+_watched_dirs = set()
+_watch_lock = threading.Lock()
+
+
+def _dispatch_file_event(event):
+    for path in (event.src_path, getattr(event, 'dest_path', None)):
+        for changed in tuple(_watch_targets.get(path, ())):
+            changed.set()
+
+
+if HAS_WATCHDOG:
+    class _FileEventDispatcher(FileSystemEventHandler):
+        def on_any_event(self, event):
+            _dispatch_file_event(event)
+
+
+def _watch_path(path, changed):
+    """Registra l'Event da impostare alle modifiche di path. False se il watch non è possibile."""
+    directory = os.path.dirname(path)
+    with _watch_lock:
+        if directory not in _watched_dirs:
+            try:
+                _get_observer().schedule(_FileEventDispatcher(), directory)
+            except OSError as e:
+                logger.error("watchdog non disponibile per %s: %s", path, e)
+                return False
+            _watched_dirs.add(directory)
+        _watch_targets.setdefault(path, set()).add(changed)
+    return True
+
+
+def _unwatch_path(path, changed):
+    with _watch_lock:
+        targets = _watch_targets.get(path)
+        if targets is not None:
+            targets.discard(changed)
+            if not targets:
+                del _watch_targets[path]
+
+
+def wait_event(event, timeout):
+    """
+    Event.wait utilizzabile dalle richieste anche con GEVENT=1. Gli Event restano
+    nativi (li impostano i thread di lavoro), ma una wait nativa nel thread
+    principale bloccherebbe l'hub e con esso tutte le connessioni: lì si attende
+    con sleep brevi (patchate, cedono la greenlet). I thread di lavoro usano la
+    wait nativa.
+    """
+    if not USE_GEVENT or threading.current_thread() is not threading.main_thread():
+        return event.wait(timeout)
+    deadline = time.monotonic() + timeout
+    while not event.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(0.05, remaining))
+    return True
+
+
+class FileChangeNotifier:
+    """
+    Attende modifiche a un file. Con watchdog il thread dorme finché il sistema
+    operativo non notifica una scrittura; senza, wait() degrada a una sleep
+    di poll_interval secondi (polling).
+    """
+    
+    def __init__(self, path, poll_interval=1.0):
+        self.path = os.path.abspath(path)
+        self.poll_interval = poll_interval
+        self._changed = threading.Event()
+        self._watched = HAS_WATCHDOG and _watch_path(self.path, self._changed)
+    
+    def wait(self, timeout=2.0):
+        """
+        Blocca fino alla prossima modifica del file o al timeout. Ritorna True se
+        è arrivata una notifica (sempre True in modalità polling).
+        """
+        if not self._watched:
+            time.sleep(self.poll_interval)
+            return True
+        changed = wait_event(self._changed, timeout)
+        self._changed.clear()
+        return changed
+    
+    def close(self):
+        if self._watched:
+            _unwatch_path(self.path, self._changed)
+            self._watched = False
+
+
+_stat_cache = {}  # path -> (istante, os.stat_result o None se assente)
+
+
+def cached_stat(path, ttl=STAT_CACHE_TTL):
+    """
+    os.stat con memo di breve durata: chiamate ripetute sullo stesso percorso
+    (polling, pagina di debug) entro ttl secondi non fanno syscall.
+    Ritorna None se il file non esiste.
+    """
+    now = time.monotonic()
+    entry = _stat_cache.get(path)
+    if entry is not None and now - entry[0] < ttl:
+        return entry[1]
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+    if len(_stat_cache) >= STAT_CACHE_MAX:
+        _stat_cache.clear()
+    _stat_cache[path] = (now, st)
+    return st
+
+
+def count_system_ffmpeg_processes():
+    """
+    Conta i processi ffmpeg dell'host leggendo /proc/<pid>/comm (solo Linux,
+    senza avviare `ps`). Ritorna 0 dove /proc non è disponibile.
+    """
+    count = 0
+    try:
+        pids = [name for name in os.listdir('/proc') if name.isdigit()]
+    except OSError:
+        return 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/comm', 'rb') as f:
+                if f.read().strip() == b'ffmpeg':
+                    count += 1
+        except OSError:
+            pass
+    return count
+
+
+def evict_stale_hls_dirs(keep=(), max_age=HLS_STALE_AGE):
+    """
+    Rimuove le directory HLS orfane (sessioni terminate senza cleanup o processi
+    precedenti) non modificate da max_age secondi, per non esaurire il tmpfs.
+    """
+    cutoff = time.time() - max_age
+    try:
+        with os.scandir(HLS_ROOT) as it:
+            for entry in it:
+                try:
+                    if (entry.name.startswith(HLS_DIR_PREFIX) and entry.path not in keep
+                            and entry.is_dir(follow_symlinks=False)
+                            and entry.stat(follow_symlinks=False).st_mtime < cutoff):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+
+
+def pin_transcribe_thread():
+    """
+    Vincola il thread corrente (worker Whisper) ai core oltre i primi
+    FFMPEG_THREADS, lasciando quelli all'encoder: meno migrazioni e cache
+    condivise tra decoder ed encoder. Solo Linux; no-op altrove.
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        return
+    try:
+        cores = sorted(os.sched_getaffinity(0))
+        if len(cores) > FFMPEG_THREADS:
+            os.sched_setaffinity(0, cores[FFMPEG_THREADS:])
+    except OSError:
+        pass
+
+
+# Istanze di modello caricate per ogni dimensione. faster-whisper (CTranslate2)
+# accetta trascrizioni concorrenti: un'istanza condivisa basta. Con openai-whisper
+# le trascrizioni di un'istanza sono serializzate dal suo lock, quindi N sessioni
+# sulla stessa istanza avanzano a 1/N del tempo reale: se ne caricano fino a
+# STT_INSTANCES_PER_MODEL (più RAM per modello, più sessioni in tempo reale)
+if FASTER_WHISPER_AVAILABLE:
+    STT_INSTANCES_PER_MODEL = 1
+else:
+    STT_INSTANCES_PER_MODEL = max(1, int(os.environ.get('STT_INSTANCES_PER_MODEL', 2)))
+
+# Istanze inutilizzate: scaricate dopo STT_IDLE_TTL secondi, e comunque ne restano
+# caricate al più MAX_IDLE_STT (le meno usate di recente escono per prime)
+STT_IDLE_TTL = int(os.environ.get('STT_IDLE_TTL', 600))
+MAX_IDLE_STT = int(os.environ.get('MAX_IDLE_STT', 3))
+
+_stt_lock = threading.Lock()
+_stt_pools = {}  # model_size -> lista di [istanza, sessioni che la usano, ultimo rilascio]
+_stt_loading = {}  # model_size -> Event impostato a caricamento concluso
+
+
+def _evict_idle_stt():
+    """Scarica le istanze inutilizzate scadute o in eccesso (LRU). Da chiamare con _stt_lock."""
+    now = time.monotonic()
+    idle = [(entry[2], size, entry) for size, pool in _stt_pools.items()
+            for entry in pool if entry[1] == 0]
+    idle.sort(key=lambda item: item[0])
+    excess = len(idle) - MAX_IDLE_STT
+    for i, (released, size, entry) in enumerate(idle):
+        if i < excess or now - released > STT_IDLE_TTL:
+            _stt_pools[size].remove(entry)
+            if not _stt_pools[size]:
+                del _stt_pools[size]
+
+
+def get_stt(model_size):
+    """
+    Assegna alla sessione l'istanza Whisper meno usata per model_size, caricandone
+    una nuova se tutte sono occupate e il limite non è raggiunto. La lingua è
+    passata ad ogni trascrizione, quindi sessioni con lingue diverse possono
+    condividere la stessa istanza. Va restituita con release_stt.
+    
+    Il caricamento avviene fuori da _stt_lock: release_stt e le richieste per
+    altre dimensioni non attendono. Chi chiede la stessa dimensione durante un
+    caricamento usa un'istanza già pronta, o attende se non ce ne sono.
+    """
+    while True:
+        with _stt_lock:
+            _evict_idle_stt()
+            pool = _stt_pools.get(model_size, [])
+            entry = min(pool, key=lambda e: e[1], default=None)
+            loading = _stt_loading.get(model_size)
+            can_grow = entry is None or (entry[1] > 0 and len(pool) < STT_INSTANCES_PER_MODEL)
+            if entry is not None and (not can_grow or loading is not None):
+                entry[1] += 1
+                return entry[0]
+            if loading is None:
+                loading = _stt_loading[model_size] = threading.Event()
+                break
+        loading.wait()  # Un altro thread sta caricando questa dimensione
+    
+    loaded = False
+    try:
+        stt = VLCSpeechToText(model_size=model_size, language="auto", use_faster_whisper=True,
+                              num_workers=TRANSCRIBE_WORKERS)
+        stt.load_model()
+        loaded = True
+        return stt
+    finally:
+        with _stt_lock:
+            del _stt_loading[model_size]
+            if loaded:
+                _stt_pools.setdefault(model_size, []).append([stt, 1, time.monotonic()])
+        loading.set()
+
+
+def release_stt(stt):
+    """Segnala che una sessione non usa più l'istanza (resta caricata per le successive)."""
+    with _stt_lock:
+        for pool in _stt_pools.values():
+            for entry in pool:
+                if entry[0] is stt:
+                    entry[1] -= 1
+                    entry[2] = time.monotonic()
+                    break
+        _evict_idle_stt()
 
 
 class VideoTranscriptionSession:
     """Gestisce una sessione di trascrizione video."""
     
-    def __init__(self, session_id, video_url, language="en", model_size="base", chunk_duration=10):
+    def __init__(self, session_id, video_url, language="en", model_size="base", chunk_duration=10,
+                 min_subs_to_start=2, partial_results=False, threads_per_ffmpeg=None):
         self.session_id = session_id
         self.video_url = video_url
         self.language = language
         self.model_size = model_size
         self.chunk_duration = chunk_duration
+        self.min_subs_to_start = min_subs_to_start  # Sottotitoli attesi prima di avviare FFmpeg (MP4)
+        self.partial_results = partial_results  # Ipotesi parziali ogni PARTIAL_STEP secondi
+        self.ffmpeg_threads = threads_per_ffmpeg or FFMPEG_THREADS  # Thread dell'encoder video
         
         # File temporanei
         self.srt_path = os.path.join(TEMP_DIR, f"subs_{session_id}.srt")
         self.video_pipe_path = None  # fallback
+        self.stream_mimetype = None  # Formato dello stream non HLS, fissato in start()
         
         # Streaming HLS
         self.use_hls_stream = True
-        self.hls_dir = tempfile.mkdtemp(prefix=f"hls_{session_id}_")
+        self.stream_handler = _stream_hls if self.use_hls_stream else _stream_mp4  # /api/stream
+        evict_stale_hls_dirs(keep={s.hls_dir for _, s in sessions.items()})
+        # session_id è "session_N": il prefisso risultante è HLS_DIR_PREFIX
+        self.hls_dir = tempfile.mkdtemp(prefix=f"hls_{session_id}_", dir=HLS_ROOT)
+        if USE_X_ACCEL:
+            os.chmod(self.hls_dir, 0o755)  # mkdtemp crea 0700: nginx deve poter leggere
         self.hls_playlist = os.path.join(self.hls_dir, 'stream.m3u8')
         self.stream_url = f"/api/hls/{session_id}/stream.m3u8"
         
@@ -102,6 +760,10 @@ class VideoTranscriptionSession:
         self.ffmpeg_audio_process = None
         self.ffmpeg_whisper_process = None  # Per filtro Whisper nativo
         self.stt = None
+        self._pool = None  # Pool di trascrizione chunk
+        self._results_lock = threading.Lock()  # Serializza l'applicazione dei risultati
+        self._finished = {}  # indice chunk -> future completato, in attesa del proprio turno
+        self._next_result = 0  # Prossimo chunk da applicare all'SRT
         
         # Metodo di trascrizione
         self.use_ffmpeg_whisper = has_ffmpeg_whisper()
@@ -113,14 +775,78 @@ class VideoTranscriptionSession:
         # Stato
         self.running = False
         self.all_subtitles = []
+        self.srt_generation = 0  # Cresce quando l'SRT è riscritto da capo (indici ripartono)
+        self._subs_ready = threading.Event()  # Impostato al raggiungimento di min_subs_to_start
+        if min_subs_to_start <= 0:
+            self._subs_ready.set()
+        self._srt_buf = bytearray()  # SRT serializzato, cresce in append
+        self._srt_dirty = False  # Buffer con sottotitoli non ancora scritti (HLS)
+        self.partial_subtitle = None  # Testo provvisorio del chunk in corso
+        self._partial_future = None  # Trascrizione parziale in esecuzione (al più una)
+        self._partial_words = (-1, [])  # (chunk, parole) dell'ipotesi parziale precedente
         self.subtitle_index = 1
         self.chunk_counter = 0
         self.status = "initializing"
         self.error = None
+        self.last_access = time.monotonic()  # Aggiornato dal registro sessioni
+        self._lifecycle_lock = threading.Lock()
+        self._cleaned = False
+        self._last_restart = time.monotonic()  # Ultimo (ri)avvio FFmpeg video
+        self._subs_at_restart = 0  # Sottotitoli già inclusi nell'ultimo avvio
+        self._stderr_ring = deque(maxlen=STDERR_RING_CHUNKS)  # Ultimo output stderr FFmpeg
+        self._video_stderr_thread = None
+        # Impostato dal thread di drain quando la playlist HLS esiste (o FFmpeg termina)
+        self.playlist_ready = threading.Event()
+        self._status_body = None  # (chiave di stato, JSON di /api/status)
         
         # Crea file SRT iniziale
         self._init_srt_file()
     
+    def ffmpeg_process_count(self):
+        """Numero di processi FFmpeg della sessione ancora in esecuzione."""
+        return sum(
+            1 for p in (self.ffmpeg_video_process, self.ffmpeg_audio_process, self.ffmpeg_whisper_process)
+            if p is not None and p.poll() is None
+        )
+    
+    def _drain_stderr(self, process):
+        """
+        Svuota lo stderr di FFmpeg in un thread dedicato, tenendo solo gli ultimi
+        blocchi nel buffer circolare: se nessuno legge la pipe (64KB) si riempie
+        e FFmpeg si blocca in scrittura. Legge a blocchi e non a righe perché le
+        statistiche di avanzamento sono separate da '\r' e non da '\n'.
+        """
+        def drain():
+            # Il muxer HLS scrive "Opening '...m3u8.tmp' for writing" e poi
+            # rinomina il file: la playlist si verifica dai blocchi successivi
+            playlist_opened = False
+            try:
+                while True:
+                    data = process.stderr.read1(STDERR_READ_SIZE)
+                    if not data:
+                        break
+                    self._stderr_ring.append(data)
+                    if not self.playlist_ready.is_set():
+                        if playlist_opened and os.path.exists(self.hls_playlist):
+                            self.playlist_ready.set()
+                        elif b'.m3u8' in data:
+                            playlist_opened = True
+            except (OSError, ValueError):
+                pass  # Pipe chiusa da stop()
+            finally:
+                # FFmpeg terminato: chi attende non deve restare bloccato fino al timeout
+                self.playlist_ready.set()
+        
+        thread = threading.Thread(target=drain, daemon=True, name=f"stderr_{self.session_id}")
+        thread.start()
+        return thread
+    
+    def _stderr_tail(self, limit=8000):
+        """Ultimo output stderr di FFmpeg raccolto dal thread di drain."""
+        if self._video_stderr_thread:
+            self._video_stderr_thread.join(timeout=1)
+        return b"".join(self._stderr_ring).decode(errors='ignore')[-limit:]
+    
     def _init_srt_file(self):
         """Inizializza il file SRT con contenuto minimo."""
         with open(self.srt_path, 'w', encoding='utf-8') as f:
@@ -138,19 +864,35 @@ class VideoTranscriptionSession:
             else:
                 # Metodo tradizionale: usa SRT pre-generato
                 target_output = None if self.use_hls_stream else self.video_pipe_path
+                # Con HLS FFmpeg non viene mai riavviato, quindi lo stesso processo
+                # estrae anche i chunk audio: la sorgente viene scaricata una sola volta
                 self.ffmpeg_video_process = restart_ffmpeg_video_process(
                     self.video_url,
                     self.srt_path,
                     target_output,
                     use_http=False,
-                    hls_output_dir=self.hls_dir if self.use_hls_stream else None
+                    hls_output_dir=self.hls_dir if self.use_hls_stream else None,
+                    audio_output_args=self._audio_pcm_args() if self.use_hls_stream else None,
+                    threads=self.ffmpeg_threads
                 )
+            self._video_stderr_thread = self._drain_stderr(self.ffmpeg_video_process)
         except Exception as e:
             self.status = "error"
             self.error = f"Errore avvio FFmpeg: {e}"
-            print(f"[Session {self.session_id}] Errore avvio FFmpeg: {e}")
+            logger.error("[Session %s] Errore avvio FFmpeg: %s", self.session_id, e)
             raise
     
+    def _audio_pcm_args(self):
+        """Argomenti FFmpeg per l'output audio PCM (s16le, 16 kHz mono) su stdout."""
+        return [
+            "-vn",
+            "-acodec", "pcm_s16le",
+            "-ar", str(SAMPLE_RATE),
+            "-ac", "1",
+            "-f", "s16le",
+            "pipe:1"
+        ]
+    
     def _launch_ffmpeg_with_whisper_filter(self):
         """
         Avvia FFmpeg con filtro Whisper nativo per trascrizione + burn-in.
@@ -172,12 +914,12 @@ class VideoTranscriptionSession:
         # 2. Filtro subtitles per burn-in
         ffmpeg_cmd = [
             "ffmpeg",
+            "-nostdin",
             "-i", self.video_url,
             "-af", whisper_filter,  # Filtro Whisper per trascrizione
             "-vf", f"subtitles='{escaped_srt_path}':force_style='FontSize=24,PrimaryColour=&Hffffff,OutlineColour=&H000000,Outline=2,Bold=1'",
-            "-c:v", "libx264",
-            "-preset", "ultrafast",
-            "-tune", "zerolatency",
+            *h264_encoder_args(["-c:v", "libx264", "-preset", "ultrafast", "-tune", "zerolatency"]),
+            "-threads", str(self.ffmpeg_threads),
             "-c:a", "copy",  # Copia audio originale (il filtro Whisper non modifica l'audio)
             "-f", "mpegts" if not self.use_hls_stream else "hls",
         ]
@@ -211,9 +953,8 @@ class VideoTranscriptionSession:
             
             # Carica modello Whisper solo se non usiamo il filtro nativo
             if not self.use_ffmpeg_whisper:
-                self.stt = VLCSpeechToText(model_size=self.model_size, language=self.language)
                 print(f"[Session {self.session_id}] Caricamento modello Whisper...")
-                self.stt.load_model()
+                self.stt = get_stt(self.model_size)
             
             if self.use_hls_stream:
                 # HLS directory già creata; pulisci eventuali file preesistenti
@@ -224,7 +965,6 @@ class VideoTranscriptionSession:
                         pass
                 print(f"[Session {self.session_id}] Streaming HLS in {self.hls_dir}")
             else:
-                import stat
                 try:
                     if self.video_pipe_path and os.path.exists(self.video_pipe_path):
                         os.unlink(self.video_pipe_path)
@@ -241,9 +981,10 @@ class VideoTranscriptionSession:
                         os.mkfifo(self.video_pipe_path, stat.S_IRUSR | stat.S_IWUSR)
                         print(f"[Session {self.session_id}] Named pipe creata: {self.video_pipe_path}")
                 except Exception as e:
-                    print(f"[Session {self.session_id}] Errore creazione pipe, uso file MP4: {e}")
+                    logger.error("[Session %s] Errore creazione pipe, uso file MP4: %s", self.session_id, e)
                     self.video_pipe_path = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False).name
                     print(f"[Session {self.session_id}] Usando file MP4: {self.video_pipe_path}")
+                self.stream_mimetype = 'video/mp4' if self.video_pipe_path.endswith('.mp4') else 'video/mp2t'
             
             # Avvia processamento audio/trascrizione
             self.running = True
@@ -256,23 +997,19 @@ class VideoTranscriptionSession:
                 whisper_monitor_thread = threading.Thread(target=self._monitor_whisper_srt, daemon=True)
                 whisper_monitor_thread.start()
             else:
-                # Con Python Whisper, avvia thread per processare audio
-                processing_thread = threading.Thread(target=self._process_audio, daemon=True)
-                processing_thread.start()
-                
                 # Con HLS, avviamo FFmpeg subito (non aspettiamo i sottotitoli)
                 # I sottotitoli verranno aggiornati in tempo reale
                 if self.use_hls_stream:
                     print(f"[Session {self.session_id}] Avvio FFmpeg immediatamente (sottotitoli verranno aggiornati in tempo reale)")
                 else:
+                    # Con Python Whisper, avvia thread per processare audio
+                    processing_thread = threading.Thread(target=self._process_audio, daemon=True)
+                    processing_thread.start()
+                    
                     # Per streaming non-HLS, aspettiamo alcuni sottotitoli
                     print(f"[Session {self.session_id}] Attesa generazione sottotitoli prima di avviare FFmpeg...")
                     max_wait = 30  # Ridotto a 30 secondi
-                    wait_count = 0
-                    while len(self.all_subtitles) < 2 and wait_count < max_wait:
-                        time.sleep(1)
-                        wait_count += 1
-                    if len(self.all_subtitles) < 2:
+                    if not self._subs_ready.wait(timeout=max_wait):
                         print(f"[Session {self.session_id}] ATTENZIONE: Solo {len(self.all_subtitles)} sottotitoli generati, avvio FFmpeg comunque")
                     else:
                         print(f"[Session {self.session_id}] {len(self.all_subtitles)} sottotitoli generati, avvio FFmpeg...")
@@ -291,200 +1028,363 @@ class VideoTranscriptionSession:
                 self._init_srt_file()
             
             self._launch_ffmpeg_process()
+            self._last_restart = time.monotonic()
+            self._subs_at_restart = len(self.all_subtitles)
+            
+            if self.use_hls_stream and not self.use_ffmpeg_whisper:
+                # Il processo FFmpeg appena avviato produce anche i chunk audio
+                processing_thread = threading.Thread(target=self._process_audio, daemon=True)
+                processing_thread.start()
             
-            # Attendi che FFmpeg inizi a scrivere
-            time.sleep(3)
+            # Attendi che FFmpeg inizi a scrivere (al massimo 3 secondi)
+            if self.use_hls_stream:
+                self._wait_first_segment(timeout=3.0)
+            else:
+                wait_for_ffmpeg_output(self.ffmpeg_video_process, self.video_pipe_path,
+                                       timeout=3.0, min_bytes=1)
             
             # Verifica che FFmpeg sia ancora in esecuzione
             if self.ffmpeg_video_process.poll() is not None:
                 print(f"[Session {self.session_id}] ERRORE: FFmpeg terminato prematuramente!")
-                stderr_output = self.ffmpeg_video_process.stderr.read().decode(errors='ignore') if self.ffmpeg_video_process.stderr else "N/A"
-                print(f"FFmpeg stderr: {stderr_output[:8000]}")
+                print(f"FFmpeg stderr: {self._stderr_tail()}")
             
             return True
             
         except Exception as e:
             self.status = "error"
             self.error = str(e)
-            print(f"Errore avvio sessione: {e}")
+            logger.error("Errore avvio sessione: %s", e)
             return False
     
+    def _wait_first_segment(self, timeout=3.0):
+        """Attende il primo segmento .ts nella directory HLS, o la fine del timeout."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.ffmpeg_video_process.poll() is not None:
+                return
+            try:
+                with os.scandir(self.hls_dir) as it:
+                    if any(e.name.endswith('.ts') for e in it):
+                        return
+            except OSError:
+                pass
+            time.sleep(0.05)
+    
     def _process_audio(self):
         """Processa l'audio in background e genera sottotitoli."""
-        chunk_dir = tempfile.mkdtemp(prefix=f"whisper_{self.session_id}_")
-        chunk_pattern = os.path.join(chunk_dir, "chunk_%04d.wav")
-        processed_chunks = set()
-        
-        # Avvia FFmpeg per estrarre audio chunk
-        ffmpeg_cmd = [
-            "ffmpeg",
-            "-i", self.video_url,
-            "-vn",
-            "-acodec", "pcm_s16le",
-            "-ar", "16000",
-            "-ac", "1",
-            "-f", "segment",
-            "-segment_time", str(self.chunk_duration),
-            "-segment_format", "wav",
-            "-reset_timestamps", "1",
-            "-strftime", "0",
-            "-y",
-            chunk_pattern
-        ]
-        
         try:
-            # Su macOS, usa start_new_session per isolare il processo
-            if sys.platform == 'darwin':
-                self.ffmpeg_audio_process = subprocess.Popen(
-                    ffmpeg_cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    start_new_session=True
-                )
+            if self.use_hls_stream:
+                # Il PCM arriva sullo stdout del processo FFmpeg HLS
+                audio_stream = self.ffmpeg_video_process.stdout
+                threading.Thread(target=self._srt_flush_loop, daemon=True).start()
             else:
-                self.ffmpeg_audio_process = subprocess.Popen(
-                    ffmpeg_cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
-                )
+                # FFmpeg video viene riavviato ad ogni sottotitolo: serve un processo
+                # separato per estrarre l'audio senza interruzioni
+                ffmpeg_cmd = ["ffmpeg", "-nostdin", "-i", self.video_url] + self._audio_pcm_args()
+                
+                # Su macOS, usa start_new_session per isolare il processo
+                if sys.platform == 'darwin':
+                    self.ffmpeg_audio_process = subprocess.Popen(
+                        ffmpeg_cmd,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        start_new_session=True
+                    )
+                else:
+                    self.ffmpeg_audio_process = subprocess.Popen(
+                        ffmpeg_cmd,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE
+                    )
+                self._drain_stderr(self.ffmpeg_audio_process)
+                audio_stream = self.ffmpeg_audio_process.stdout
             
-            while self.running and (self.ffmpeg_audio_process.poll() is None or 
-                                   self.ffmpeg_video_process.poll() is None):
-                # Cerca nuovi chunk
-                for i in range(self.chunk_counter, self.chunk_counter + 10):
-                    chunk_file = os.path.join(chunk_dir, f"chunk_{i:04d}.wav")
-                    
-                    if os.path.exists(chunk_file) and chunk_file not in processed_chunks:
-                        processed_chunks.add(chunk_file)
-                        time.sleep(0.5)
-                        
-                        if os.path.getsize(chunk_file) == 0:
-                            continue
-                        
-                        # Calcola timestamp
-                        chunk_start_time = (i * self.chunk_duration)
-                        chunk_end_time = ((i + 1) * self.chunk_duration)
-                        
-                        try:
-                            # Trascrivi chunk
-                            result = self.stt.model.transcribe(
-                                chunk_file,
-                                language=self.language if self.language != "auto" else None,
-                                task="transcribe",
-                                fp16=False
-                            )
-                            
-                            text = result["text"].strip()
-                            if text:
-                                # Aggiungi sottotitolo
-                                subtitle = {
-                                    'index': self.subtitle_index,
-                                    'start': chunk_start_time,
-                                    'end': chunk_end_time,
-                                    'text': text
-                                }
-                                self.all_subtitles.append(subtitle)
-                                
-                                # Aggiorna file SRT
-                                try:
-                                    with open(self.srt_path, 'w', encoding='utf-8') as f:
-                                        for sub in self.all_subtitles:
-                                            f.write(f"{sub['index']}\n")
-                                            f.write(f"{format_srt_time(sub['start'])} --> {format_srt_time(sub['end'])}\n")
-                                            f.write(f"{sub['text']}\n\n")
-                                    print(f"[Session {self.session_id}] SRT aggiornato con {len(self.all_subtitles)} sottotitoli")
-                                except Exception as e:
-                                    print(f"Errore scrittura SRT: {e}")
-                                
-                                # Con HLS, non riavviamo FFmpeg per ogni sottotitolo per evitare interruzioni
-                                # FFmpeg processerà il video con i sottotitoli disponibili al momento dell'avvio
-                                # Per aggiornare i sottotitoli, riavviamo solo periodicamente (ogni 10 sottotitoli)
-                                if not self.use_hls_stream:
-                                    # Con streaming MP4, riavviamo per ogni sottotitolo
-                                    print(f"[Session {self.session_id}] Riavvio FFmpeg per applicare {len(self.all_subtitles)} sottotitoli")
-                                    try:
-                                        if self.ffmpeg_video_process:
-                                            self.ffmpeg_video_process.terminate()
-                                            try:
-                                                self.ffmpeg_video_process.wait(timeout=2)
-                                            except subprocess.TimeoutExpired:
-                                                self.ffmpeg_video_process.kill()
-                                                self.ffmpeg_video_process.wait()
-                                    except Exception as e:
-                                        print(f"Errore terminazione FFmpeg: {e}")
-                                    
-                                    time.sleep(0.5)
-                                    
-                                    try:
-                                        os.sync()
-                                        if os.path.exists(self.srt_path) and os.path.getsize(self.srt_path) > 0:
-                                            srt_size = os.path.getsize(self.srt_path)
-                                            print(f"[Session {self.session_id}] File SRT verificato: {srt_size} bytes, {len(self.all_subtitles)} sottotitoli")
-                                        else:
-                                            print(f"[Session {self.session_id}] ATTENZIONE: File SRT vuoto o non trovato!")
-                                        
-                                        self._launch_ffmpeg_process()
-                                        print(f"[Session {self.session_id}] FFmpeg riavviato con SRT aggiornato")
-                                        time.sleep(2)
-                                    except Exception as e:
-                                        print(f"Errore riavvio FFmpeg: {e}")
-                                        import traceback
-                                        traceback.print_exc()
-                                else:
-                                    # Con HLS, NON riavviamo FFmpeg per evitare discontinuità nello stream.
-                                    # FFmpeg legge il file SRT solo all'avvio, quindi i sottotitoli saranno visibili
-                                    # per la parte del video che viene processata dopo che i sottotitoli sono stati generati.
-                                    # Questo è un compromesso: i sottotitoli non saranno visibili per la parte iniziale
-                                    # del video, ma lo stream sarà stabile e continuo.
-                                    # I sottotitoli vengono comunque aggiornati nel file SRT per riferimento futuro.
-                                    pass
-                                
-                                self.subtitle_index += 1
-                            
-                            os.unlink(chunk_file)
-                            self.chunk_counter = i + 1
-                            
-                        except Exception as e:
-                            print(f"Errore trascrizione chunk: {e}")
-                            if os.path.exists(chunk_file):
-                                try:
-                                    os.unlink(chunk_file)
-                                except:
-                                    pass
+            self._pool = ThreadPoolExecutor(
+                max_workers=TRANSCRIBE_WORKERS,
+                thread_name_prefix=f"whisper_{self.session_id}",
+                initializer=pin_transcribe_thread
+            )
+            # Limita i chunk in volo: se Whisper è più lento del tempo reale la
+            # lettura si ferma invece di accumulare campioni in memoria
+            inflight = threading.BoundedSemaphore(TRANSCRIBE_WORKERS * 2)
+            chunk_samples = int(self.chunk_duration * SAMPLE_RATE)
+            partial_step = int(PARTIAL_STEP * SAMPLE_RATE) if self.partial_results else None
+            i = 0
+            
+            while self.running:
+                # La lettura blocca finché il chunk è completo: nessun polling del disco,
+                # il chunk è disponibile appena FFmpeg lo scrive sulla pipe
+                samples = self._read_pcm_chunk(
+                    audio_stream, chunk_samples,
+                    step=partial_step,
+                    on_step=lambda partial, i=i: self._submit_partial(i, partial)
+                )
+                if samples is None:
+                    break  # EOF: FFmpeg terminato
                 
-                time.sleep(0.5)
+                while self.running and not inflight.acquire(timeout=0.5):
+                    pass
+                if not self.running:
+                    break
+                future = self._pool.submit(self._transcribe_chunk, samples)
+                future.add_done_callback(lambda f: inflight.release())
+                future.add_done_callback(lambda f, i=i: self._on_chunk_done(i, f))
+                i += 1
+                self.chunk_counter = i
                 
         except Exception as e:
             self.status = "error"
             self.error = str(e)
-            print(f"Errore processamento audio: {e}")
+            logger.error("Errore processamento audio: %s", e)
         finally:
-            # Pulisci
+            # Attende i chunk ancora in coda: le callback li applicano all'SRT
+            if self._pool:
+                self._pool.shutdown(wait=True, cancel_futures=not self.running)
+            self._flush_srt()
+    
+    def _append_srt(self, sub):
+        """Serializza solo il nuovo sottotitolo in coda al buffer SRT in memoria."""
+        self._srt_buf += (
+            f"{sub['index']}\n"
+            f"{format_srt_time(sub['start'])} --> {format_srt_time(sub['end'])}\n"
+            f"{sub['text']}\n\n"
+        ).encode('utf-8')
+    
+    def _flush_srt(self):
+        """Scrive l'SRT se ci sono sottotitoli non ancora salvati."""
+        with self._results_lock:
+            if not self._srt_dirty:
+                return
+            self._srt_dirty = False
+            try:
+                self._write_srt()
+            except Exception as e:
+                logger.error("Errore scrittura SRT: %s", e)
+    
+    def _srt_flush_loop(self):
+        """Con HLS salva l'SRT al più ogni SRT_FLUSH_INTERVAL secondi."""
+        while self.running:
+            time.sleep(SRT_FLUSH_INTERVAL)
+            self._flush_srt()
+    
+    def _write_srt(self):
+        """
+        Scrive il buffer SRT su un file temporaneo e lo sostituisce atomicamente:
+        FFmpeg non legge mai un file SRT scritto a metà.
+        """
+        tmp_path = self.srt_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._srt_buf)
+        os.replace(tmp_path, self.srt_path)
+    
+    @staticmethod
+    def _read_pcm_chunk(stream, n_samples, step=None, on_step=None):
+        """
+        Legge fino a n_samples campioni int16 dalla pipe direttamente in un array
+        numpy, senza copie intermedie. Ritorna None a EOF senza dati.
+        
+        Se step è indicato, on_step riceve i campioni letti finora ogni step
+        campioni (il chunk completo escluso).
+        """
+        samples = np.empty(n_samples, dtype=np.int16)
+        view = memoryview(samples).cast('B')
+        step_bytes = step * 2 if step else len(view)
+        mark = min(step_bytes, len(view))
+        filled = 0
+        while filled < len(view):
+            n = stream.readinto(view[filled:mark])
+            if not n:
+                break
+            filled += n
+            if filled == mark and mark < len(view):
+                on_step(samples[:filled // 2])
+                mark = min(mark + step_bytes, len(view))
+        filled //= 2  # scarta un eventuale campione incompleto
+        if not filled:
+            return None
+        return samples[:filled]
+    
+    def _transcribe_chunk(self, samples):
+        """Trascrive un chunk audio PCM int16 (eseguito nel pool)."""
+        audio = samples.astype(np.float32)
+        audio *= 1.0 / 32768.0
+        
+        # Chunk di silenzio: niente forward pass (ed evita testo allucinato)
+        if is_silent(audio):
+            return ""
+        
+        return self.stt.transcribe_chunk(
+            audio,
+            language=self.language if self.language != "auto" else None
+        )
+    
+    def _submit_partial(self, i, samples):
+        """
+        Accoda la trascrizione provvisoria dell'audio del chunk i letto finora.
+        Se la precedente è ancora in corso il passo viene saltato: il lettore
+        della pipe non si blocca mai in attesa del modello.
+        """
+        if self._partial_future is not None and not self._partial_future.done():
+            return
+        self._partial_future = self._pool.submit(self._transcribe_partial, i, samples.copy())
+    
+    def _transcribe_partial(self, i, samples):
+        """
+        Local agreement: pubblica come sottotitolo provvisorio solo il prefisso di
+        parole identico in due ipotesi successive sullo stesso chunk, che non
+        cambia più man mano che arriva altro audio.
+        """
+        audio = samples.astype(np.float32)
+        audio *= 1.0 / 32768.0
+        if is_silent(audio):
+            return
+        words = self.stt.transcribe_words(
+            audio,
+            language=self.language if self.language != "auto" else None
+        )
+        if i < self._next_result:
+            return  # Chunk già trascritto per intero
+        
+        prev_chunk, previous = self._partial_words
+        self._partial_words = (i, words)
+        if prev_chunk != i:
+            return  # Prima ipotesi del chunk: nulla con cui confrontarla
+        agreed = 0
+        for (_, _, a), (_, _, b) in zip(previous, words):
+            if a.strip() != b.strip():
+                break
+            agreed += 1
+        if agreed:
+            chunk_start_time = i * self.chunk_duration
+            self.partial_subtitle = {
+                'start': chunk_start_time,
+                'end': chunk_start_time + words[agreed - 1][1],
+                'text': "".join(w[2] for w in words[:agreed]).strip()
+            }
+    
+    def _on_chunk_done(self, i, future):
+        """
+        Callback di completamento: applica all'SRT i chunk nell'ordine originale
+        anche se le trascrizioni terminano in ordine diverso.
+        """
+        with self._results_lock:
+            self._finished[i] = future
+            while self.running and self._next_result in self._finished:
+                self._apply_chunk_result(self._next_result, self._finished.pop(self._next_result))
+                self._next_result += 1
+    
+    def _apply_chunk_result(self, i, future):
+        """Aggiunge al file SRT il testo trascritto del chunk i."""
+        try:
+            text = future.result()
+        except Exception as e:
+            logger.error("Errore trascrizione chunk: %s", e)
+            return
+        
+        if not text:
+            return
+        
+        # Calcola timestamp
+        chunk_start_time = (i * self.chunk_duration)
+        chunk_end_time = ((i + 1) * self.chunk_duration)
+        
+        # Aggiungi sottotitolo
+        subtitle = {
+            'index': self.subtitle_index,
+            'start': chunk_start_time,
+            'end': chunk_end_time,
+            'text': text
+        }
+        self.all_subtitles.append(subtitle)
+        self._append_srt(subtitle)
+        self.partial_subtitle = None
+        if len(self.all_subtitles) >= self.min_subs_to_start:
+            self._subs_ready.set()
+        
+        # Aggiorna file SRT. Con HLS FFmpeg non rilegge l'SRT: dopo i primi
+        # sottotitoli la scrittura è rimandata al flush periodico
+        if self.use_hls_stream and len(self.all_subtitles) > self.min_subs_to_start:
+            self._srt_dirty = True
+        else:
+            try:
+                self._write_srt()
+                print(f"[Session {self.session_id}] SRT aggiornato con {len(self.all_subtitles)} sottotitoli")
+            except Exception as e:
+                logger.error("Errore scrittura SRT: %s", e)
+        
+        # Con HLS, non riavviamo FFmpeg per ogni sottotitolo per evitare interruzioni
+        # FFmpeg processerà il video con i sottotitoli disponibili al momento dell'avvio
+        # Per aggiornare i sottotitoli, riavviamo solo periodicamente (ogni 10 sottotitoli)
+        if not self.use_hls_stream and self._restart_due():
+            # Con streaming MP4 il riavvio è l'unico modo per applicare l'SRT aggiornato
+            print(f"[Session {self.session_id}] Riavvio FFmpeg per applicare {len(self.all_subtitles)} sottotitoli")
             try:
-                for f in os.listdir(chunk_dir):
+                if self.ffmpeg_video_process:
+                    self.ffmpeg_video_process.terminate()
                     try:
-                        os.unlink(os.path.join(chunk_dir, f))
-                    except:
-                        pass
-                os.rmdir(chunk_dir)
-            except:
-                pass
+                        self.ffmpeg_video_process.wait(timeout=2)
+                    except subprocess.TimeoutExpired:
+                        self.ffmpeg_video_process.kill()
+                        self.ffmpeg_video_process.wait()
+            except Exception as e:
+                logger.error("Errore terminazione FFmpeg: %s", e)
+            
+            time.sleep(0.5)
+            
+            try:
+                if os.path.exists(self.srt_path) and os.path.getsize(self.srt_path) > 0:
+                    srt_size = os.path.getsize(self.srt_path)
+                    print(f"[Session {self.session_id}] File SRT verificato: {srt_size} bytes, {len(self.all_subtitles)} sottotitoli")
+                else:
+                    print(f"[Session {self.session_id}] ATTENZIONE: File SRT vuoto o non trovato!")
+                
+                self._launch_ffmpeg_process()
+                self._last_restart = time.monotonic()
+                self._subs_at_restart = len(self.all_subtitles)
+                print(f"[Session {self.session_id}] FFmpeg riavviato con SRT aggiornato")
+                time.sleep(2)
+            except Exception as e:
+                logger.exception("Errore riavvio FFmpeg: %s", e)
+        elif self.use_hls_stream:
+            # Con HLS, NON riavviamo FFmpeg per evitare discontinuità nello stream.
+            # FFmpeg legge il file SRT solo all'avvio, quindi i sottotitoli saranno visibili
+            # per la parte del video che viene processata dopo che i sottotitoli sono stati generati.
+            # Questo è un compromesso: i sottotitoli non saranno visibili per la parte iniziale
+            # del video, ma lo stream sarà stabile e continuo.
+            # I sottotitoli vengono comunque aggiornati nel file SRT per riferimento futuro.
+            pass
+        
+        self.subtitle_index += 1
+    
+    def _restart_due(self):
+        """
+        True se è il momento di riavviare FFmpeg (MP4) per applicare i nuovi
+        sottotitoli: ogni riavvio riapre la sorgente e riscalda l'encoder, quindi
+        avviene al più ogni RESTART_EVERY_SUBS sottotitoli o RESTART_INTERVAL secondi.
+        """
+        if self.ffmpeg_video_process is None:
+            return False  # Primo avvio gestito da start()
+        return (len(self.all_subtitles) - self._subs_at_restart >= RESTART_EVERY_SUBS
+                or time.monotonic() - self._last_restart >= RESTART_INTERVAL)
     
     def _monitor_whisper_srt(self):
         """
         Monitora il file SRT generato dal filtro Whisper nativo e aggiorna
         la lista dei sottotitoli per l'API.
         """
-        import re
         last_size = 0
         last_mtime = 0
+        srt_tail_pos = 0  # Offset fino a cui il file è già stato parsato
+        srt_last_index = 0  # Indice dell'ultimo blocco SRT acquisito
+        last_tail_hash = None  # Hash dei byte oltre srt_tail_pos all'ultimo controllo
         
         print(f"[Session {self.session_id}] Monitoraggio SRT generato da Whisper...")
+        notifier = FileChangeNotifier(self.srt_path)
         
         while self.running:
             try:
                 if not os.path.exists(self.srt_path):
-                    time.sleep(1)
+                    notifier.wait()
                     continue
                 
                 current_size = os.path.getsize(self.srt_path)
@@ -493,158 +1393,138 @@ class VideoTranscriptionSession:
                 # Se il file è cambiato, leggi e aggiorna
                 if current_size != last_size or current_mtime != last_mtime:
                     try:
-                        with open(self.srt_path, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                        
-                        # Parse SRT e aggiorna all_subtitles
-                        # Formato SRT: index, timestamp, text, blank line
-                        srt_pattern = r'(\d+)\s+(\d{2}):(\d{2}):(\d{2}),(\d{3})\s+-->\s+(\d{2}):(\d{2}):(\d{2}),(\d{3})\s+(.+?)(?=\n\d+\s+\d{2}:|\Z)'
-                        matches = re.findall(srt_pattern, content, re.DOTALL)
+                        if current_size < srt_tail_pos:
+                            # File riscritto da capo: riparte il parsing
+                            srt_tail_pos = 0
+                            srt_last_index = 0
+                            last_tail_hash = None
+                            self.all_subtitles = []
+                            self.srt_generation += 1
                         
-                        new_subtitles = []
-                        for match in matches:
-                            idx = int(match[0])
-                            start_h, start_m, start_s, start_ms = map(int, match[1:5])
-                            end_h, end_m, end_s, end_ms = map(int, match[5:9])
-                            text = match[9].strip()
-                            
-                            start_time = start_h * 3600 + start_m * 60 + start_s + start_ms / 1000.0
-                            end_time = end_h * 3600 + end_m * 60 + end_s + end_ms / 1000.0
-                            
-                            subtitle = {
-                                'index': idx,
-                                'start': start_time,
-                                'end': end_time,
-                                'text': text
-                            }
-                            new_subtitles.append(subtitle)
-                        
-                        # Aggiorna solo se ci sono nuovi sottotitoli
-                        if len(new_subtitles) > len(self.all_subtitles):
-                            self.all_subtitles = new_subtitles
-                            self.subtitle_index = len(new_subtitles) + 1
-                            print(f"[Session {self.session_id}] SRT aggiornato: {len(new_subtitles)} sottotitoli da Whisper")
+                        # Mappa il file in memoria: la regex lavora direttamente sulle
+                        # pagine del file, senza copiarne il contenuto
+                        if current_size > srt_tail_pos:
+                            with open(self.srt_path, 'rb') as f, \
+                                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                                # Coda non ancora parsata invariata (es. solo mtime aggiornato)
+                                tail_hash = hashlib.blake2b(mm[srt_tail_pos:], digest_size=8).digest()
+                                if tail_hash != last_tail_hash:
+                                    last_tail_hash = tail_hash
+                                    
+                                    # Parsa solo fino all'ultimo blocco completo (terminato da riga vuota)
+                                    end = mm.rfind(b'\n\n', srt_tail_pos)
+                                    if end != -1:
+                                        added = 0
+                                        for match in _SRT_BLOCK_RE.finditer(mm, srt_tail_pos, end + 1):
+                                            idx = int(match[1])
+                                            if idx <= srt_last_index:
+                                                continue
+                                            start_h, start_m, start_s, start_ms = map(int, match.groups()[1:5])
+                                            end_h, end_m, end_s, end_ms = map(int, match.groups()[5:9])
+                                            
+                                            start_time = start_h * 3600 + start_m * 60 + start_s + start_ms / 1000.0
+                                            end_time = end_h * 3600 + end_m * 60 + end_s + end_ms / 1000.0
+                                            
+                                            self.all_subtitles.append({
+                                                'index': idx,
+                                                'start': start_time,
+                                                'end': end_time,
+                                                'text': match[10].decode('utf-8', errors='replace').strip()
+                                            })
+                                            srt_last_index = idx
+                                            added += 1
+                                        
+                                        srt_tail_pos = end + 2
+                                        
+                                        if added:
+                                            self.subtitle_index = len(self.all_subtitles) + 1
+                                            print(f"[Session {self.session_id}] SRT aggiornato: {len(self.all_subtitles)} sottotitoli da Whisper")
                         
                         last_size = current_size
                         last_mtime = current_mtime
                         
                     except Exception as e:
-                        print(f"Errore lettura SRT Whisper: {e}")
+                        logger.error("Errore lettura SRT Whisper: %s", e)
                 
-                time.sleep(1)  # Controlla ogni secondo
+                # Attende la prossima scrittura (o un secondo, senza watchdog)
+                notifier.wait()
                 
             except Exception as e:
-                print(f"Errore monitoraggio SRT Whisper: {e}")
+                logger.error("Errore monitoraggio SRT Whisper: %s", e)
                 time.sleep(2)
+        
+        notifier.close()
     
     def stop(self):
         """Ferma la sessione."""
         self.running = False
         
-        if self.ffmpeg_video_process:
+        # Entrambi i processi ricevono SIGTERM prima di attenderne uno: il tempo
+        # di arresto è quello del più lento, non la somma dei due
+        processes = [p for p in (self.ffmpeg_video_process, self.ffmpeg_audio_process) if p]
+        self.ffmpeg_video_process = None
+        self.ffmpeg_audio_process = None
+        terminate_processes(processes, timeout=3)
+    
+    def try_stop(self):
+        """
+        Ferma la sessione se non è già stata pulita.
+        
+        Returns:
+            False se la sessione era già stata pulita
+        """
+        with self._lifecycle_lock:
+            if self._cleaned:
+                return False
+            self.stop()
+            return True
+    
+    def cleanup(self):
+        """
+        Pulisce i file temporanei e le risorse.
+        
+        Più chiamate concorrenti (stop/cleanup, cleanup di massa, eviction) sono
+        serializzate dal lock: solo la prima esegue il cleanup.
+        
+        Returns:
+            False se la sessione era già stata pulita
+        """
+        with self._lifecycle_lock:
+            if self._cleaned:
+                return False
+            self._cleaned = True
+            
+            self.stop()
+            
+            # Pulisci file temporanei
             try:
-                # Chiudi stdin, stdout, stderr prima di terminare
-                if self.ffmpeg_video_process.stdin:
-                    try:
-                        self.ffmpeg_video_process.stdin.close()
-                    except:
-                        pass
-                if self.ffmpeg_video_process.stdout:
-                    try:
-                        self.ffmpeg_video_process.stdout.close()
-                    except:
-                        pass
-                if self.ffmpeg_video_process.stderr:
-                    try:
-                        self.ffmpeg_video_process.stderr.close()
-                    except:
-                        pass
-                
-                # Termina il processo
-                self.ffmpeg_video_process.terminate()
-                try:
-                    self.ffmpeg_video_process.wait(timeout=3)
-                except subprocess.TimeoutExpired:
-                    # Se non termina, forza kill
-                    self.ffmpeg_video_process.kill()
-                    self.ffmpeg_video_process.wait()
+                if os.path.exists(self.srt_path):
+                    os.unlink(self.srt_path)
             except Exception as e:
-                print(f"Errore terminazione ffmpeg_video_process: {e}")
-                try:
-                    if self.ffmpeg_video_process.poll() is None:
-                        self.ffmpeg_video_process.kill()
-                except:
-                    pass
-            finally:
-                self.ffmpeg_video_process = None
-        
-        if self.ffmpeg_audio_process:
+                logger.error("Errore rimozione SRT: %s", e)
+            
             try:
-                # Chiudi stdin, stdout, stderr prima di terminare
-                if self.ffmpeg_audio_process.stdin:
+                if self.video_pipe_path and os.path.exists(self.video_pipe_path):
                     try:
-                        self.ffmpeg_audio_process.stdin.close()
-                    except:
-                        pass
-                if self.ffmpeg_audio_process.stdout:
-                    try:
-                        self.ffmpeg_audio_process.stdout.close()
-                    except:
-                        pass
-                if self.ffmpeg_audio_process.stderr:
-                    try:
-                        self.ffmpeg_audio_process.stderr.close()
+                        os.unlink(self.video_pipe_path)
                     except:
                         pass
-                
-                # Termina il processo
-                self.ffmpeg_audio_process.terminate()
-                try:
-                    self.ffmpeg_audio_process.wait(timeout=3)
-                except subprocess.TimeoutExpired:
-                    # Se non termina, forza kill
-                    self.ffmpeg_audio_process.kill()
-                    self.ffmpeg_audio_process.wait()
             except Exception as e:
-                print(f"Errore terminazione ffmpeg_audio_process: {e}")
-                try:
-                    if self.ffmpeg_audio_process.poll() is None:
-                        self.ffmpeg_audio_process.kill()
-                except:
-                    pass
-            finally:
-                self.ffmpeg_audio_process = None
-    
-    def cleanup(self):
-        """Pulisce i file temporanei e le risorse."""
-        self.stop()
-        
-        # Pulisci file temporanei
-        try:
-            if os.path.exists(self.srt_path):
-                os.unlink(self.srt_path)
-        except Exception as e:
-            print(f"Errore rimozione SRT: {e}")
-        
-        try:
-            if self.video_pipe_path and os.path.exists(self.video_pipe_path):
+                logger.error("Errore rimozione pipe: %s", e)
+            
+            if self.hls_dir and os.path.exists(self.hls_dir):
                 try:
-                    os.unlink(self.video_pipe_path)
-                except:
-                    pass
-        except Exception as e:
-            print(f"Errore rimozione pipe: {e}")
-        
-        if self.hls_dir and os.path.exists(self.hls_dir):
-            try:
-                shutil.rmtree(self.hls_dir, ignore_errors=True)
-            except Exception as e:
-                print(f"Errore rimozione directory HLS: {e}")
-        
-        # Assicurati che i processi siano None
-        self.ffmpeg_video_process = None
-        self.ffmpeg_audio_process = None
-        self.stt = None
+                    shutil.rmtree(self.hls_dir, ignore_errors=True)
+                except Exception as e:
+                    logger.error("Errore rimozione directory HLS: %s", e)
+            
+            # Assicurati che i processi siano None
+            self.ffmpeg_video_process = None
+            self.ffmpeg_audio_process = None
+            if self.stt is not None:
+                release_stt(self.stt)
+            self.stt = None
+            return True
 
 
 @app.route('/')
@@ -677,10 +1557,8 @@ def index():
         error_msg = f"Errore caricamento template: {str(e)}<br><pre>{traceback.format_exc()}</pre><br>Template dir: {app.template_folder}"
         return error_msg, 500
 
-@app.route('/test')
-def test():
-    """Pagina di test semplice."""
-    return """
+# Pagina di test: la cartella template non cambia, quindi è costruita una volta sola
+_TEST_PAGE = ("""
     <!DOCTYPE html>
     <html>
     <head>
@@ -698,78 +1576,117 @@ def test():
         <p><a href="/">Torna alla pagina principale</a></p>
     </body>
     </html>
-    """
+    """).encode('utf-8')
 
-@app.route('/debug')
-def debug():
-    """Pagina di debug."""
-    import subprocess
+
+@app.route('/test')
+def test():
+    """Pagina di test semplice."""
+    return Response(_TEST_PAGE, mimetype='text/html')
+
+
+_debug_cache = (0.0, None, None)  # (istante, info, JSON serializzato in bytes)
+
+
+def debug_info(verify=False):
+    """
+    Raccoglie lo stato del server per la pagina di debug. Il risultato (e il suo
+    JSON) resta valido DEBUG_CACHE_TTL secondi: la pagina è tipicamente ricaricata
+    di continuo. Con verify=True conta anche i processi ffmpeg di sistema.
+    """
+    global _debug_cache
+    now = time.monotonic()
+    if not verify and now - _debug_cache[0] < DEBUG_CACHE_TTL:
+        return _debug_cache[1], _debug_cache[2]
     
     template_path = os.path.join(app.template_folder, 'index.html')
     simple_path = os.path.join(app.template_folder, 'index_simple.html')
     
-    # Conta processi FFmpeg
-    try:
-        ffmpeg_count = len([p for p in subprocess.check_output(['ps', 'aux']).decode().split('\n') if 'ffmpeg' in p and 'video_session' in p])
-    except:
-        ffmpeg_count = 0
-    
-    # Lista sessioni attive
-    active_sessions = []
-    for session_id, session in sessions.items():
-        active_sessions.append({
-            'id': session_id,
-            'status': session.status,
-            'error': session.error,
-            'pipe_exists': os.path.exists(session.video_pipe_path) if hasattr(session, 'video_pipe_path') else False,
-            'srt_exists': os.path.exists(session.srt_path) if hasattr(session, 'srt_path') else False,
-            'ffmpeg_running': session.ffmpeg_video_process.poll() is None if session.ffmpeg_video_process else False
-        })
+    # Una sola passata sulle sessioni: elenco e processi FFmpeg
+    snapshot = sessions.items()
+    active_sessions = [{
+        'id': session_id,
+        'status': session.status,
+        'error': session.error,
+        'pipe_exists': bool(session.video_pipe_path) and cached_stat(session.video_pipe_path) is not None,
+        'srt_exists': cached_stat(session.srt_path) is not None,
+        'ffmpeg_running': session.ffmpeg_video_process.poll() is None if session.ffmpeg_video_process else False
+    } for session_id, session in snapshot]
     
+    if verify:
+        ffmpeg_count = count_system_ffmpeg_processes()
+    else:
+        ffmpeg_count = sum(session.ffmpeg_process_count() for _, session in snapshot)
+    
+    index_stat = cached_stat(template_path)
+    simple_stat = cached_stat(simple_path)
     info = {
         'template_folder': app.template_folder,
-        'index_exists': os.path.exists(template_path),
-        'simple_exists': os.path.exists(simple_path),
-        'index_size': os.path.getsize(template_path) if os.path.exists(template_path) else 0,
-        'simple_size': os.path.getsize(simple_path) if os.path.exists(simple_path) else 0,
+        'index_exists': index_stat is not None and stat.S_ISREG(index_stat.st_mode),
+        'simple_exists': simple_stat is not None and stat.S_ISREG(simple_stat.st_mode),
+        'index_size': index_stat.st_size if index_stat else 0,
+        'simple_size': simple_stat.st_size if simple_stat else 0,
         'cwd': os.getcwd(),
         'script_dir': os.path.dirname(os.path.abspath(__file__)),
-        'active_sessions_count': len(sessions),
+        'active_sessions_count': len(snapshot),
         'active_sessions': active_sessions,
         'ffmpeg_processes': ffmpeg_count,
         'platform': sys.platform
     }
-    
-    return f"""
+    info_json = json_dumps_bytes(info, indent=True)
+    if not verify:
+        _debug_cache = (now, info, info_json)
+    return info, info_json
+
+
+# Frammenti statici della pagina di debug, uniti ai valori con un solo join
+_DEBUG_PAGE_HEAD = """
     <!DOCTYPE html>
     <html>
     <head>
         <title>Debug Info</title>
         <meta charset="UTF-8">
         <style>
-            body {{ font-family: monospace; padding: 20px; background: #f5f5f5; }}
-            pre {{ background: white; padding: 15px; border-radius: 5px; border: 1px solid #ddd; overflow-x: auto; }}
-            .error {{ color: #c62828; font-weight: bold; }}
-            .ok {{ color: #2e7d32; }}
-            a {{ color: #1976d2; text-decoration: none; }}
-            a:hover {{ text-decoration: underline; }}
+            body { font-family: monospace; padding: 20px; background: #f5f5f5; }
+            pre { background: white; padding: 15px; border-radius: 5px; border: 1px solid #ddd; overflow-x: auto; }
+            .error { color: #c62828; font-weight: bold; }
+            .ok { color: #2e7d32; }
+            a { color: #1976d2; text-decoration: none; }
+            a:hover { text-decoration: underline; }
         </style>
     </head>
     <body>
         <h1>🔍 Debug Info</h1>
-        <pre>{json.dumps(info, indent=2)}</pre>
+        <pre>""".encode('utf-8')
+_DEBUG_PAGE_SESSIONS = """</pre>
         <p><a href="/">← Torna alla pagina principale</a></p>
         <p><a href="/test">Pagina di test</a></p>
         <hr>
         <h2>Test API</h2>
         <p><a href="/api/status/session_1" target="_blank">Status Session 1</a></p>
-        <p>Sessioni attive: <strong>{len(sessions)}</strong></p>
-        <p>Processi FFmpeg: <strong>{ffmpeg_count}</strong></p>
+        <p>Sessioni attive: <strong>""".encode('utf-8')
+_DEBUG_PAGE_FFMPEG = b"""</strong></p>
+        <p>Processi FFmpeg: <strong>"""
+_DEBUG_PAGE_TAIL = b"""</strong></p>
     </body>
     </html>
     """
 
 
+@app.route('/debug')
+def debug():
+    """Pagina di debug."""
+    # Con ?verify=1 conta anche i processi ffmpeg del sistema
+    info, info_json = debug_info(verify=request.args.get('verify') == '1')
+    
+    return Response(b"".join((
+        _DEBUG_PAGE_HEAD, info_json,
+        _DEBUG_PAGE_SESSIONS, str(info['active_sessions_count']).encode(),
+        _DEBUG_PAGE_FFMPEG, str(info['ffmpeg_processes']).encode(),
+        _DEBUG_PAGE_TAIL
+    )), mimetype='text/html')
+
+
 @app.route('/api/start', methods=['POST'])
 def start_transcription():
     """Avvia una nuova sessione di trascrizione."""
@@ -780,23 +1697,30 @@ def start_transcription():
     language = data.get('language', 'en')
     model_size = data.get('model_size', 'base')
     chunk_duration = int(data.get('chunk_duration', 10))
+    partial_results = bool(data.get('partial_results', False))
     
     if not video_url:
-        return jsonify({'error': 'URL video richiesto'}), 400
+        return json_response({'error': 'URL video richiesto'}, 400)
     
     if not is_url(video_url) and not os.path.exists(video_url):
-        return jsonify({'error': 'URL o percorso file non valido'}), 400
+        return json_response({'error': 'URL o percorso file non valido'}, 400)
     
     # Crea nuova sessione
     session_counter += 1
     session_id = f"session_{session_counter}"
     
+    # I core riservati a FFmpeg vengono divisi tra le sessioni attive: senza
+    # limite ogni processo avvierebbe un thread per core e si contenderebbero la CPU
+    threads_per_ffmpeg = max(1, FFMPEG_THREADS // (len(sessions) + 1))
+    
     session = VideoTranscriptionSession(
         session_id=session_id,
         video_url=video_url,
         language=language,
         model_size=model_size,
-        chunk_duration=chunk_duration
+        chunk_duration=chunk_duration,
+        partial_results=partial_results,
+        threads_per_ffmpeg=threads_per_ffmpeg
     )
     
     sessions[session_id] = session
@@ -809,7 +1733,7 @@ def start_transcription():
     thread.start()
     print(f"[Session {session_id}] Thread avviato")
     
-    return jsonify({
+    return json_response({
         'session_id': session_id,
         'video_url': video_url,
         'stream_url': session.stream_url,
@@ -821,157 +1745,178 @@ def start_transcription():
 @app.route('/api/stream/<session_id>')
 def stream_video(session_id):
     """Stream del video con sottotitoli burn-in."""
-    if session_id not in sessions:
+    session = sessions.get(session_id)
+    if session is None:
         return "Sessione non trovata", 404
-    
-    session = sessions[session_id]
-    
-    if session.use_hls_stream:
-        playlist_path = os.path.join(session.hls_dir, 'stream.m3u8')
-        # Attendi fino a 10 secondi che la playlist venga generata
-        max_wait = 10
-        wait_count = 0
-        while not os.path.exists(playlist_path) and wait_count < max_wait:
-            time.sleep(0.5)
-            wait_count += 0.5
-        if not os.path.exists(playlist_path):
-            return "Playlist non disponibile (ancora in generazione)", 404
-        return send_file(
-            playlist_path,
-            mimetype='application/vnd.apple.mpegurl',
-            conditional=True
-        )
-    
+    # Handler scelto alla creazione della sessione in base alla modalità di streaming
+    return session.stream_handler(session)
+
+
+def _stream_hls(session):
+    """Risponde con la playlist HLS della sessione, attendendone la creazione."""
+    playlist_path = session.hls_playlist
+    # Attendi fino a 10 secondi che la playlist venga generata
+    wait_event(session.playlist_ready, timeout=10)
+    if not os.path.exists(playlist_path):
+        return "Playlist non disponibile (ancora in generazione)", 404
+    return send_file(
+        playlist_path,
+        mimetype='application/vnd.apple.mpegurl',
+        conditional=True
+    )
+
+
+def _stream_mp4(session):
+    """Stream progressivo del file MP4/MPEG-TS (o della named pipe) scritto da FFmpeg."""
     if not session.video_pipe_path or not os.path.exists(session.video_pipe_path):
         return "Stream non disponibile", 404
     
+    # MIME type deciso alla creazione del file in start()
+    mimetype = session.stream_mimetype or 'video/mp2t'
+    
+    # File completo (FFmpeg terminato correttamente): send_file usa il
+    # file_wrapper del server WSGI o X-Sendfile, senza il ciclo di lettura Python
+    process = session.ffmpeg_video_process
+    if (process is not None and process.poll() == 0
+            and not stat.S_ISFIFO(os.stat(session.video_pipe_path).st_mode)):
+        return send_file_sequential(session.video_pipe_path, mimetype=mimetype, conditional=True)
+    
     def generate():
         """Genera lo stream video dal file."""
         max_wait = 30  # Attendi max 30 secondi per l'inizio dello stream
         wait_count = 0
         
         try:
-            # Attendi che il file esista e abbia contenuto
-            while (not os.path.exists(session.video_pipe_path) or 
-                   os.path.getsize(session.video_pipe_path) == 0) and wait_count < max_wait:
+            # Attendi che il file esista e abbia contenuto (una sola stat per controllo)
+            # (una named pipe ha sempre dimensione 0: basta che esista)
+            st = cached_stat(session.video_pipe_path)
+            while (st is None or (st.st_size == 0 and not stat.S_ISFIFO(st.st_mode))) and wait_count < max_wait:
                 time.sleep(0.5)
                 wait_count += 1
+                st = cached_stat(session.video_pipe_path)
             
-            if not os.path.exists(session.video_pipe_path):
-                print(f"Errore: file non creato dopo {max_wait} secondi")
+            if st is None:
+                stream_log.error("Errore: file non creato dopo %s secondi", max_wait)
                 return
             
+            is_pipe = stat.S_ISFIFO(st.st_mode)
+            
             # Per file MP4, assicurati che abbia almeno alcuni KB prima di iniziare
-            file_size = os.path.getsize(session.video_pipe_path)
-            if file_size < 1024:  # Meno di 1KB
-                print(f"File troppo piccolo ({file_size} bytes), attendo...")
+            file_size = st.st_size
+            if file_size < 1024 and not is_pipe:  # Meno di 1KB
+                stream_log.debug("File troppo piccolo (%d bytes), attendo...", file_size)
                 time.sleep(2)
             
             # Apri il file
-            is_pipe = False
-            if hasattr(os.path, 'isfifo'):
-                try:
-                    is_pipe = os.path.isfifo(session.video_pipe_path)
-                except:
-                    pass
-            
+            selector = None
             try:
                 f = open(session.video_pipe_path, 'rb')
-                # Solo per pipe, imposta non-blocking
-                if is_pipe and HAS_FCNTL and hasattr(fcntl, 'F_SETFL'):
-                    try:
-                        flags = fcntl.fcntl(f.fileno(), fcntl.F_GETFL)
-                        fcntl.fcntl(f.fileno(), fcntl.F_SETFL, flags | os.O_NONBLOCK)
-                    except (OSError, AttributeError):
-                        pass
+                enlarge_pipe_buffer(f.fileno())
+                advise_sequential(f.fileno())
+                # Solo per pipe: lettura non bloccante e attesa dei dati con
+                # epoll/kqueue invece di ritentare a intervalli fissi
+                if is_pipe:
+                    os.set_blocking(f.fileno(), False)
+                    selector = selectors.DefaultSelector()
+                    selector.register(f, selectors.EVENT_READ)
             except Exception as e:
-                print(f"Errore apertura file: {e}")
+                stream_log.error("Errore apertura file: %s", e)
                 return
             
-            empty_reads = 0
-            max_empty_reads = 300  # Max 30 secondi di letture vuote per file MP4
-            last_size = 0
-            no_growth_count = 0
+            # Buffer riutilizzato per tutta la durata dello stream: evita di allocare
+            # un nuovo oggetto bytes ad ogni lettura. readinto ritorna subito ciò che
+            # è disponibile, quindi un buffer grande non aggiunge latenza ma, quando
+            # il client è indietro, recupera il ritardo con una sola syscall
+            buf = bytearray(STREAM_READ_SIZE)
+            view = memoryview(buf)
+            
+            # Il generatore dorme finché FFmpeg non scrive nel file (notifica del
+            # sistema operativo con watchdog, altrimenti polling ogni 0.3s)
+            notifier = FileChangeNotifier(session.video_pipe_path, poll_interval=0.3)
+            max_idle = 30  # Secondi senza nuovi dati prima di chiudere lo stream
             min_file_size = 1024 * 100  # Attendi almeno 100KB prima di iniziare
             
             # Attendi che il file abbia una dimensione minima
-            while os.path.getsize(session.video_pipe_path) < min_file_size and wait_count < max_wait:
-                time.sleep(0.5)
-                wait_count += 1
-                if wait_count >= max_wait:
-                    print(f"File troppo piccolo dopo attesa, procedo comunque")
+            deadline = time.monotonic() + max_wait
+            while not is_pipe and (cached_stat(session.video_pipe_path) or st).st_size < min_file_size:
+                if time.monotonic() >= deadline:
+                    stream_log.debug("File troppo piccolo dopo attesa, procedo comunque")
                     break
+                notifier.wait(timeout=0.5)
             
-            while session.running or (session.ffmpeg_video_process and session.ffmpeg_video_process.poll() is None):
+            idle_since = None
+            while True:
                 try:
                     # Per file MP4, leggi dalla posizione corrente
-                    chunk = f.read(1024 * 128)  # Leggi 128KB alla volta (buffer più grande)
-                    if chunk:
-                        empty_reads = 0
-                        no_growth_count = 0
-                        yield chunk
-                    else:
-                        # Verifica se il file sta crescendo
-                        current_size = os.path.getsize(session.video_pipe_path)
-                        if current_size > last_size:
-                            last_size = current_size
-                            no_growth_count = 0
-                            # File sta crescendo, riposiziona e riprova
-                            f.seek(f.tell())  # Mantieni posizione
-                            time.sleep(0.3)  # Attesa leggermente più lunga
-                        else:
-                            no_growth_count += 1
-                            empty_reads += 1
-                            if empty_reads > max_empty_reads or no_growth_count > 100:
-                                print("File non sta crescendo o troppi read vuoti")
-                                break
-                            time.sleep(0.3)  # Attesa più lunga per permettere a FFmpeg di scrivere
-                except (IOError, OSError) as e:
-                    if e.errno == 11:  # EAGAIN - nessun dato disponibile (solo per pipe)
-                        time.sleep(0.1)
+                    n = f.readinto(buf)  # Leggi fino a STREAM_READ_SIZE alla volta nel buffer
+                    if n is None:
+                        # Pipe senza dati: dorme finché FFmpeg non scrive
+                        selector.select(timeout=0.5)
                         continue
-                    else:
-                        print(f"Errore lettura file: {e}")
+                    if n:
+                        idle_since = None
+                        # WSGI richiede bytes: la copia avviene solo quando ci sono dati
+                        yield bytes(view[:n])
+                        continue
+                    
+                    # Fine file: termina se FFmpeg non scriverà altro
+                    ffmpeg_alive = (session.ffmpeg_video_process is not None
+                                    and session.ffmpeg_video_process.poll() is None)
+                    if not session.running and not ffmpeg_alive:
+                        break
+                    if idle_since is None:
+                        idle_since = time.monotonic()
+                    elif time.monotonic() - idle_since > max_idle:
+                        stream_log.debug("File non sta crescendo")
                         break
+                    notifier.wait(timeout=0.5)
+                except BlockingIOError:
+                    # EAGAIN sulla pipe: come sopra, attende che diventi leggibile
+                    selector.select(timeout=0.5)
+                    continue
+                except (IOError, OSError) as e:
+                    stream_log.error("Errore lettura file: %s", e)
+                    break
                 except Exception as e:
-                    print(f"Errore generico: {e}")
+                    stream_log.error("Errore generico: %s", e)
                     break
             
+            notifier.close()
+            if selector is not None:
+                selector.close()
             f.close()
         except Exception as e:
-            print(f"Errore streaming: {e}")
-            import traceback
-            traceback.print_exc()
-    
-    # Determina MIME type in base al formato file
-    if session.video_pipe_path.endswith('.mp4'):
-        mimetype = 'video/mp4'
-        content_type = 'video/mp4'
-    else:
-        mimetype = 'video/mp2t'
-        content_type = 'video/mp2t'
+            stream_log.exception("Errore streaming: %s", e)
     
     return Response(
         stream_with_context(generate()),
         mimetype=mimetype,
-        headers={
-            'Content-Type': content_type,
-            'Cache-Control': 'no-cache, no-store, must-revalidate',
-            'Pragma': 'no-cache',
-            'Expires': '0',
-            'X-Accel-Buffering': 'no',
-            'Accept-Ranges': 'bytes'
-        }
+        headers=_STREAM_HEADERS[mimetype]
+    )
+
+
+# Header degli stream progressivi, uno per formato: la Response ne copia le
+# coppie nei propri Headers, quindi le tuple restano condivise tra le richieste
+_STREAM_HEADERS = {
+    mimetype: (
+        ('Content-Type', mimetype),
+        ('Cache-Control', 'no-cache, no-store, must-revalidate'),
+        ('Pragma', 'no-cache'),
+        ('Expires', '0'),
+        ('X-Accel-Buffering', 'no'),
+        ('Accept-Ranges', 'bytes'),
     )
+    for mimetype in ('video/mp4', 'video/mp2t')
+}
 
 
 @app.route('/api/hls/<session_id>/<path:filename>')
 def serve_hls_file(session_id, filename):
     """Serve playlist e segmenti HLS generati per una sessione."""
-    if session_id not in sessions:
+    session = sessions.get(session_id)
+    if session is None:
         return "Sessione non trovata", 404
     
-    session = sessions[session_id]
     if not session.use_hls_stream:
         return "Sessione non configurata per HLS", 400
     
@@ -987,92 +1932,161 @@ def serve_hls_file(session_id, filename):
     if filename.endswith('.m3u8'):
         mimetype = 'application/vnd.apple.mpegurl'
     
-    return send_file(requested_path, mimetype=mimetype, conditional=True)
+    if USE_X_ACCEL:
+        # nginx legge il file dal disco e lo invia al client: nessun byte passa da Python
+        response = Response(status=200, mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = (
+            f"{X_ACCEL_PREFIX}/{os.path.relpath(requested_path, HLS_ROOT)}"
+        )
+        return response
+    
+    return send_file_sequential(requested_path, mimetype=mimetype, conditional=True)
 
 
 @app.route('/api/status/<session_id>')
 def get_status(session_id):
     """Ottiene lo stato della sessione."""
-    if session_id not in sessions:
-        return jsonify({'error': 'Sessione non trovata'}), 404
+    session = sessions.get(session_id)
+    if session is None:
+        return _json_bytes_response(_NOT_FOUND_BODY, 404)
+    
+    partial = session.partial_subtitle
+    subtitles = session.all_subtitles  # una riscrittura assegna una nuova lista
+    generation = session.srt_generation
+    
+    # Con ?since=<index> solo i sottotitoli successivi: il client tiene last_index e
+    # riparte da capo quando generation cambia (SRT riscritto, indici ripartiti)
+    since = request.args.get('since', type=int)
+    if since is not None:
+        start = len(subtitles)
+        while start > 0 and subtitles[start - 1]['index'] > since:
+            start -= 1
+        new_subtitles = subtitles[start:]
+        return json_response({
+            'session_id': session_id,
+            'status': session.status,
+            'error': session.error,
+            'subtitles_count': len(subtitles),
+            'subtitles': new_subtitles,
+            'last_index': new_subtitles[-1]['index'] if new_subtitles else since,
+            'generation': generation,
+            'translated': False,
+            'partial': partial
+        })
     
-    session = sessions[session_id]
+    # Il corpo cambia solo con nuovi sottotitoli o cambi di stato: tra un
+    # sottotitolo e l'altro il polling riceve il JSON già serializzato
+    key = (session.status, session.error, generation, len(subtitles),
+           (partial['end'], partial['text']) if partial else None)
+    cached = session._status_body
+    if cached is not None and cached[0] == key:
+        return _json_bytes_response(cached[1])
     
-    return jsonify({
+    last_subtitles = subtitles[-10:]  # Ultimi 10
+    body = json_dumps_bytes({
         'session_id': session_id,
         'status': session.status,
         'error': session.error,
-        'subtitles_count': len(session.all_subtitles),
-        'subtitles': session.all_subtitles[-10:] if session.all_subtitles else []  # Ultimi 10
+        'subtitles_count': len(subtitles),
+        'subtitles': last_subtitles,
+        'last_index': last_subtitles[-1]['index'] if last_subtitles else -1,
+        'generation': generation,
+        'translated': False,
+        'partial': partial
     })
+    session._status_body = (key, body)
+    return _json_bytes_response(body)
 
 
 @app.route('/api/stop/<session_id>', methods=['POST'])
 def stop_session(session_id):
     """Ferma una sessione."""
-    if session_id not in sessions:
-        return jsonify({'error': 'Sessione non trovata'}), 404
+    # Riferimento locale: resta valido anche se un cleanup concorrente
+    # rimuove la sessione dal registro durante stop()
+    session = sessions.get(session_id)
+    if session is None:
+        return _json_bytes_response(_NOT_FOUND_BODY, 404)
     
-    session = sessions[session_id]
-    session.stop()
+    if not session.try_stop():
+        return _json_bytes_response(_ALREADY_CLEANED_BODY)
     
-    return jsonify({'status': 'stopped'})
+    return _json_bytes_response(_STOPPED_BODY)
 
 
 @app.route('/api/cleanup/<session_id>', methods=['POST'])
 def cleanup_session(session_id):
     """Pulisce una sessione."""
-    if session_id not in sessions:
-        return jsonify({'error': 'Sessione non trovata'}), 404
+    # Rimozione atomica: se due richieste concorrenti arrivano insieme,
+    # solo la prima ottiene la sessione e ne esegue il cleanup
+    session = sessions.pop(session_id, None)
+    if session is None:
+        return _json_bytes_response(_NOT_FOUND_BODY, 404)
     
-    session = sessions[session_id]
     try:
-        session.cleanup()
-    except Exception as e:
-        print(f"Errore cleanup sessione {session_id}: {e}")
-    finally:
-        if session_id in sessions:
-            del sessions[session_id]
+        if not session.cleanup():
+            return _json_bytes_response(_ALREADY_CLEANED_BODY)
+    except Exception:
+        logger.exception("Errore cleanup sessione %s", session_id)
+    
+    return _json_bytes_response(_CLEANED_BODY)
+
+def _cleanup_all_sessions_impl():
+    """
+    Pulisce tutte le sessioni attive.
+    
+    Il cleanup di ogni sessione attende soprattutto la terminazione dei processi
+    FFmpeg, quindi le sessioni vengono pulite in parallelo.
+    
+    Returns:
+        Numero di sessioni pulite senza errori
+    """
+    def drain():
+        # Svuota il registro una voce alla volta: ogni sessione viene rimossa
+        # prima del cleanup, senza copiare l'intero registro in una lista
+        while True:
+            try:
+                yield sessions.popitem()
+            except KeyError:
+                return
     
-    return jsonify({'status': 'cleaned'})
+    with ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as executor:
+        return sum(executor.map(_safe_cleanup, drain()))
+
 
 @app.route('/api/cleanup/all', methods=['POST'])
-def cleanup_all_sessions():
+def cleanup_all_sessions_route():
     """Pulisce tutte le sessioni attive."""
-    global sessions
-    cleaned = 0
-    for session_id, session in list(sessions.items()):
-        try:
-            session.cleanup()
-            cleaned += 1
-        except Exception as e:
-            print(f"Errore cleanup sessione {session_id}: {e}")
-    sessions.clear()
-    return jsonify({'status': 'cleaned', 'sessions_cleaned': cleaned})
+    cleaned = _cleanup_all_sessions_impl()
+    return _json_bytes_response(b'{"status": "cleaned", "sessions_cleaned": %d}' % cleaned)
 
 
-def cleanup_all_sessions():
-    """Pulisce tutte le sessioni attive."""
-    global sessions
-    for session_id, session in list(sessions.items()):
-        try:
-            session.cleanup()
-        except Exception as e:
-            print(f"Errore cleanup sessione {session_id}: {e}")
-    sessions.clear()
+# Impostato dal signal handler quando è richiesta la terminazione del server
+_shutdown = threading.Event()
+_cleanup_done = False
+
+
+def _do_cleanup():
+    """Pulizia finale delle sessioni allo shutdown, eseguita una sola volta."""
+    global _cleanup_done
+    if not _cleanup_done:
+        _cleanup_done = True
+        _cleanup_all_sessions_impl()
 
 
 def signal_handler(signum, frame):
-    """Gestisce i segnali di terminazione per pulire le risorse."""
-    print("\n\nRicevuto segnale di terminazione, pulizia risorse...")
-    cleanup_all_sessions()
+    """
+    Gestisce i segnali di terminazione.
+    
+    Registra solo la richiesta di uscita e interrompe il server: la pulizia delle
+    sessioni (lock, subprocess, I/O) avviene nel finally del thread principale,
+    non dentro il signal handler.
+    """
+    _shutdown.set()
     sys.exit(0)
 
 
-if __name__ == '__main__':
-    import argparse
-    import signal
-    
+def main():
+    """Entry point: parsing argomenti, gestione segnali e avvio del server."""
     # Registra handler per segnali di terminazione
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
@@ -1090,19 +2104,31 @@ if __name__ == '__main__':
     print(f"Template folder: {app.template_folder}")
     print(f"Premi Ctrl+C per fermare\n")
     
-    # Disabilita il controllo degli accessi per debug
-    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
-    
     try:
-        app.run(host=args.host, port=args.port, debug=args.debug, threaded=True, use_reloader=False)
+        if USE_GEVENT and not args.debug:
+            # Server WSGI gevent: gli stream parcheggiano una greenlet (pochi KB)
+            # invece di un thread con il suo stack
+            print("Server WSGI: gevent")
+            WSGIServer((args.host, args.port), app, log=None).serve_forever()
+        elif HAS_WAITRESS and not args.debug:
+            # Server WSGI di produzione; la pulizia delle sessioni avviene solo
+            # dopo che serve() è ritornato (nel finally)
+            print("Server WSGI: waitress")
+            waitress_serve(app, host=args.host, port=args.port, threads=16,
+                           channel_timeout=60, cleanup_interval=30)
+        else:
+            app.run(host=args.host, port=args.port, debug=args.debug, threaded=True, use_reloader=False)
     except KeyboardInterrupt:
         print("\n\nInterruzione da utente, pulizia risorse...")
-        cleanup_all_sessions()
     except PermissionError as e:
         print(f"\n❌ Errore permessi: {e}")
         print(f"Prova con una porta diversa: python web_app.py --port 8080")
-        cleanup_all_sessions()
         sys.exit(1)
     finally:
-        cleanup_all_sessions()
+        if _shutdown.is_set():
+            print("\n\nRicevuto segnale di terminazione, pulizia risorse...")
+        _do_cleanup()
+
 
+if __name__ == '__main__':
+    main()
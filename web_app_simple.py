@@ -11,11 +11,50 @@ import tempfile
 import threading
 import time
 import json
-from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+import logging
+import re
+import mmap
+import selectors
+import shutil
+import shlex
+import socket
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, send_file
 from flask_cors import CORS
 
+# watchdog è opzionale: notifiche di modifica dell'SRT (inotify/FSEvents)
+# invece del controllo periodico della dimensione
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    HAS_WATCHDOG = True
+except ImportError:
+    HAS_WATCHDOG = False
+
+# waitress è opzionale: se non installato si usa il server di sviluppo di Flask
+try:
+    from waitress import serve as waitress_serve
+    HAS_WAITRESS = True
+except ImportError:
+    HAS_WAITRESS = False
+
+# orjson è opzionale: serializzazione JSON in C per /api/status, interrogato di continuo
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+# Log di dettaglio (es. comando FFmpeg completo): LOG_LEVEL=DEBUG per vederli,
+# a INFO la stringa non viene nemmeno costruita
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+logger.addHandler(logging.StreamHandler())
+logger.propagate = False  # waitress chiama basicConfig: senza, ogni record uscirebbe due volte
+
 # Cerca FFmpeg compilato con Whisper
-FFMPEG_PATH = None
 # Supporta macOS, Linux on-premise e Railway/Docker
 if os.path.exists("/Users/ube/ffmpeg_build/ffmpeg"):
     FFMPEG_BUILD_DIR = "/Users/ube/ffmpeg_build/ffmpeg"  # macOS
@@ -26,70 +65,134 @@ else:
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 FFMPEG_WRAPPER = os.path.join(SCRIPT_DIR, "ffmpeg_whisper_wrapper.sh")
 
-print(f"\n=== Ricerca FFmpeg con Whisper ===")
-print(f"Wrapper path: {FFMPEG_WRAPPER}")
-print(f"Wrapper esiste: {os.path.exists(FFMPEG_WRAPPER)}")
-print(f"FFmpeg build esiste: {os.path.exists(os.path.join(FFMPEG_BUILD_DIR, 'ffmpeg'))}")
+# Ricerca case-insensitive direttamente sui bytes dell'elenco filtri
+_WHISPER_RE = re.compile(rb'(?i)whisper')
+
+
+def _has_whisper(result):
+    """True se l'output di `ffmpeg -filters` (CompletedProcess) cita il filtro Whisper."""
+    return bool(_WHISPER_RE.search(result.stdout) or _WHISPER_RE.search(result.stderr))
+
+
+# Esito della ricerca salvato su disco: ai riavvii successivi niente subprocess
+# di prova finché i binari candidati non cambiano
+PROBE_CACHE_PATH = os.path.join(os.path.expanduser("~/.cache/vls-speech2text"), "ffmpeg_probe.json")
+
+
+def _probe_cache_key():
+    """Identità dei binari candidati: [percorso, mtime, dimensione] per ognuno."""
+    key = []
+    for path in (FFMPEG_WRAPPER, os.path.join(FFMPEG_BUILD_DIR, "ffmpeg"),
+                 "/usr/local/bin/ffmpeg", shutil.which("ffmpeg")):
+        if not path:
+            continue
+        try:
+            st = os.stat(path)
+            key.append([path, st.st_mtime_ns, st.st_size])
+        except OSError:
+            key.append([path, None, None])
+    return key
+
+
+def _load_ffmpeg_probe(key):
+    """Ritorna (percorso, has_whisper) dalla cache se la chiave coincide, altrimenti None."""
+    try:
+        with open(PROBE_CACHE_PATH, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get('key') == key:
+            return cached['path'], bool(cached['has_whisper'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _save_ffmpeg_probe(key, path, has_whisper):
+    """Salva l'esito della ricerca (scrittura atomica con rename)."""
+    try:
+        os.makedirs(os.path.dirname(PROBE_CACHE_PATH), exist_ok=True)
+        tmp_path = f"{PROBE_CACHE_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'path': path, 'has_whisper': has_whisper, 'key': key}, f)
+        os.replace(tmp_path, PROBE_CACHE_PATH)
+    except OSError as e:
+        print(f"Impossibile salvare cache FFmpeg: {e}")
+
 
-# Prima prova con wrapper script per FFmpeg compilato
-if os.path.exists(FFMPEG_WRAPPER) and os.path.exists(os.path.join(FFMPEG_BUILD_DIR, "ffmpeg")):
+def _probe_ffmpeg(path, timeout):
+    """
+    Verifica che path sia un FFmpeg funzionante con filtro Whisper.
+    
+    Returns:
+        (exit code di -version/-filters o None se non avviabile o scaduto,
+         True se ha il filtro Whisper)
+    """
     try:
-        print(f"Provo wrapper: {FFMPEG_WRAPPER}")
         result = subprocess.run(
-            [FFMPEG_WRAPPER, "-version"],
+            [path, "-version"],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            timeout=3
+            timeout=timeout
         )
-        if result.returncode == 0:
-            filters_result = subprocess.run(
-                [FFMPEG_WRAPPER, "-filters"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=3
-            )
-            output = (filters_result.stdout + filters_result.stderr).decode('utf-8', errors='ignore')
-            if "whisper" in output.lower():
-                FFMPEG_PATH = FFMPEG_WRAPPER
-                print(f"✓ FFmpeg con Whisper trovato (via wrapper): {FFMPEG_WRAPPER}")
-            else:
-                print(f"✗ Wrapper funziona ma Whisper non trovato")
-        else:
-            print(f"✗ Wrapper non funziona (exit code {result.returncode})")
-    except Exception as e:
-        print(f"Errore verifica FFmpeg wrapper: {e}")
-        import traceback
-        traceback.print_exc()
-
-# Se non trovato, prova /usr/local/bin/ffmpeg (dopo installazione, incluso Railway/Docker)
-if not FFMPEG_PATH and os.path.exists("/usr/local/bin/ffmpeg"):
-    try:
-        result = subprocess.run(
-            ["/usr/local/bin/ffmpeg", "-version"],
+        if result.returncode != 0:
+            return result.returncode, False
+        filters_result = subprocess.run(
+            [path, "-filters"],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            timeout=2
+            timeout=timeout
         )
-        if result.returncode == 0:
-            filters_result = subprocess.run(
-                ["/usr/local/bin/ffmpeg", "-filters"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=2
-            )
-            output = (filters_result.stdout + filters_result.stderr).decode('utf-8', errors='ignore')
-            if "whisper" in output.lower():
-                FFMPEG_PATH = "/usr/local/bin/ffmpeg"
-                print(f"✓ FFmpeg con Whisper trovato: {FFMPEG_PATH}")
-    except:
-        pass
+        if filters_result.returncode != 0:
+            return filters_result.returncode, False
+        return 0, _has_whisper(filters_result)
+    except Exception as e:
+        print(f"Errore verifica FFmpeg {path}: {e}")
+        return None, False
 
-# Fallback: FFmpeg nel PATH (Homebrew, senza Whisper, o Railway/system)
-if not FFMPEG_PATH:
-    FFMPEG_PATH = "ffmpeg"
+
+def _discover_ffmpeg():
+    """
+    Cerca un FFmpeg con filtro Whisper tra i candidati noti. Le prove (subprocess
+    indipendenti) partono in parallelo: il tempo è quello della più lenta, non
+    la somma; vince il primo candidato valido in ordine di priorità.
+    
+    Returns:
+        (percorso FFmpeg, True se ha il filtro Whisper, True se l'esito è
+         definitivo: nessuna prova è fallita, scaduta o terminata con errore)
+    """
+    print(f"\n=== Ricerca FFmpeg con Whisper ===")
+    print(f"Wrapper path: {FFMPEG_WRAPPER}")
+    print(f"Wrapper esiste: {os.path.exists(FFMPEG_WRAPPER)}")
+    print(f"FFmpeg build esiste: {os.path.exists(os.path.join(FFMPEG_BUILD_DIR, 'ffmpeg'))}")
+    
+    # Candidati in ordine di priorità: wrapper per FFmpeg compilato,
+    # /usr/local/bin/ffmpeg (dopo installazione, incluso Railway/Docker), FFmpeg nel PATH
+    candidates = []
+    if os.path.exists(FFMPEG_WRAPPER) and os.path.exists(os.path.join(FFMPEG_BUILD_DIR, "ffmpeg")):
+        candidates.append((FFMPEG_WRAPPER, 3))
+    if os.path.exists("/usr/local/bin/ffmpeg"):
+        candidates.append(("/usr/local/bin/ffmpeg", 2))
+    candidates.append(("ffmpeg", 5))
+    
+    with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        results = list(executor.map(lambda c: _probe_ffmpeg(*c), candidates))
+    
+    for (path, _), (exit_code, has_whisper) in zip(candidates, results):
+        if path == FFMPEG_WRAPPER:
+            if exit_code is not None and exit_code != 0:
+                print(f"✗ Wrapper non funziona (exit code {exit_code})")
+            elif exit_code == 0 and not has_whisper:
+                print(f"✗ Wrapper funziona ma Whisper non trovato")
+        if has_whisper:
+            print(f"✓ FFmpeg con Whisper trovato: {path}")
+            return path, True, True
+    
+    # Fallback: FFmpeg nel PATH (Homebrew, senza Whisper, o Railway/system)
     print("⚠ FFmpeg con Whisper non trovato")
     print("  Su Railway/cloud, FFmpeg potrebbe non avere il filtro Whisper nativo")
     print("  L'app userà Python Whisper come fallback se disponibile")
+    conclusive = all(exit_code == 0 for exit_code, _ in results)
+    return "ffmpeg", False, conclusive
+
 
 # Configura Flask
 template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
@@ -99,45 +202,335 @@ CORS(app)
 # Stato globale
 sessions = {}
 session_counter = 0
+_sessions_lock = threading.Lock()  # Protegge session_counter e le modifiche a sessions
 TEMP_DIR = tempfile.gettempdir()
 
-def check_ffmpeg_whisper():
-    """Verifica se FFmpeg ha il filtro Whisper."""
-    try:
-        result = subprocess.run(
-            [FFMPEG_PATH, "-filters"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=5
-        )
-        output = (result.stdout + result.stderr).decode('utf-8', errors='ignore')
-        has_whisper = "whisper" in output.lower()
-        if has_whisper:
-            version_result = subprocess.run(
-                [FFMPEG_PATH, "-version"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=2
-            )
-            version = version_result.stdout.decode('utf-8', errors='ignore').split('\n')[0]
-            print(f"✓ Filtro Whisper verificato in {FFMPEG_PATH}")
-            print(f"  Versione: {version}")
-        return has_whisper
-    except Exception as e:
-        print(f"Errore verifica Whisper: {e}")
-        return False
+# Sottotitoli tenuti in memoria per sessione (originali e tradotti)
+MAX_SUBTITLES = 10000
+
+
+def _tail(items, n):
+    """Ultimi n elementi di una deque (o lista) come lista, senza copiarla tutta."""
+    start = max(0, len(items) - max(0, n))
+    return [items[i] for i in range(start, len(items))]
+
 
+def _since(items, since):
+    """Sottotitoli con 'index' > since: sono in coda, la deque è ordinata per indice."""
+    start = len(items)
+    while start > 0 and items[start - 1]['index'] > since:
+        start -= 1
+    return [items[i] for i in range(start, len(items))]
 
-# Verifica subito quale FFmpeg viene usato
-print(f"\n=== Verifica FFmpeg ===")
-print(f"FFMPEG_PATH selezionato: {FFMPEG_PATH}")
-HAS_WHISPER_FILTER = check_ffmpeg_whisper()
+
+# Processi FFmpeg+Whisper contemporanei: ognuno carica il proprio modello, quindi
+# oltre questo limite le sessioni si contendono CPU e RAM e rallentano tutte
+MAX_FFMPEG_WORKERS = int(os.environ.get('MAX_FFMPEG_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+_ffmpeg_slots = threading.BoundedSemaphore(MAX_FFMPEG_WORKERS)
+# Attesa massima (secondi) del segnale di avvio di FFmpeg (caricamento modello incluso)
+STARTUP_TIMEOUT = 30
+
+# Thread espliciti per encoder e filtro Whisper: di default libx264 ne avvia uno
+# per core e whisper.cpp (OpenMP) altrettanti, contendendosi gli stessi core
+ENCODER_THREADS = max(2, (os.cpu_count() or 4) // 2)
+# Il video passa senza ri-codifica (i sottotitoli arrivano come traccia WebVTT separata).
+# TRANSCODE_VIDEO=1 ripristina libx264 per sorgenti con codec non supportati da MP4/browser
+TRANSCODE_VIDEO = os.environ.get('TRANSCODE_VIDEO', '0') == '1'
+if TRANSCODE_VIDEO:
+    VIDEO_CODEC_ARGS = [
+        "-c:v", "libx264",
+        "-threads", str(ENCODER_THREADS),
+        "-preset", "ultrafast",
+        "-tune", "zerolatency",
+        "-g", "30",  # GOP size per frammentazione
+        "-sc_threshold", "0",  # Disabilita scene change detection
+    ]
+else:
+    VIDEO_CODEC_ARGS = ["-c:v", "copy"]
+WHISPER_THREADS = os.environ.get('WHISPER_THREADS', '4')
+FFMPEG_ENV = {**os.environ, 'OMP_NUM_THREADS': WHISPER_THREADS, 'OPENBLAS_NUM_THREADS': '1'}
+
+# Verifica subito quale FFmpeg viene usato (dalla cache se i binari non sono cambiati)
+_probe_key = _probe_cache_key()
+_probe = _load_ffmpeg_probe(_probe_key)
+if _probe is not None:
+    FFMPEG_PATH, HAS_WHISPER_FILTER = _probe
+    print(f"\n=== Verifica FFmpeg (cache: {PROBE_CACHE_PATH}) ===")
+    print(f"FFMPEG_PATH selezionato: {FFMPEG_PATH}")
+else:
+    FFMPEG_PATH, HAS_WHISPER_FILTER, _conclusive = _discover_ffmpeg()
+    print(f"\n=== Verifica FFmpeg ===")
+    print(f"FFMPEG_PATH selezionato: {FFMPEG_PATH}")
+    # Un timeout o un errore (es. avvio a freddo lento) non va memorizzato:
+    # renderebbe permanente il "filtro Whisper assente" fino al cambio dei binari
+    if _conclusive:
+        _save_ffmpeg_probe(_probe_key, FFMPEG_PATH, HAS_WHISPER_FILTER)
 if HAS_WHISPER_FILTER:
     print("✓ Filtro Whisper nativo disponibile in FFmpeg")
 else:
     print("⚠ Filtro Whisper nativo NON disponibile - installa FFmpeg 8.0+ con --enable-whisper")
 
 
+# Separatori di riga nello stderr di FFmpeg (le statistiche usano '\r')
+_LINE_SPLIT_RE = re.compile(rb'[\r\n]')
+
+# Blocco SRT: timestamp con virgola o punto (Whisper usa il punto), testo fino
+# all'inizio del blocco successivo o alla fine del testo
+_SRT_RE = re.compile(
+    r'(?P<idx>\d+)\s+'
+    r'(?P<h1>\d{2}):(?P<m1>\d{2}):(?P<s1>\d{2})[,.](?P<ms1>\d{3})\s+-->\s+'
+    r'(?P<h2>\d{2}):(?P<m2>\d{2}):(?P<s2>\d{2})[,.](?P<ms2>\d{3})\s+'
+    r'(?P<text>.+?)(?=\n\d+\s+\d{2}:|\Z)',
+    re.DOTALL
+)
+# Solo il punto dei timestamp (00:00:02.994 -> 00:00:02,994), non quelli nel testo
+_TS_DOT_RE = re.compile(rb'(\d{2}:\d{2}:\d{2})\.(\d{3})')
+_TS_SEP_RE = re.compile(rb'\d{2}:\d{2}:\d{2}([,.])\d{3}')
+# SRT iniziale, scritto prima che il filtro Whisper crei il file vero
+_SRT_PLACEHOLDER = b"1\n00:00:00,000 --> 00:00:01,000\nCaricamento...\n\n"
+
+
+def _srt_seconds(h, m, s, ms):
+    """Timestamp SRT (campi stringa) in secondi."""
+    return int(h) * 3600 + int(m) * 60 + int(s) + int(ms) / 1000.0
+
+
+@lru_cache(maxsize=4096)
+def _srt_timestamp(seconds, sep=','):
+    """
+    Secondi in timestamp SRT (HH:MM:SS,mmm); con sep='.' il formato WebVTT.
+    In cache: ogni nuovo rendering ripete gli stessi inizio/fine dei cue già visti.
+    """
+    # round, non int: i float di _srt_seconds (es. 2.9989999...) perderebbero 1 ms
+    s, ms = divmod(round(seconds * 1000), 1000)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
+    return f"{h:02d}:{m:02d}:{s:02d}{sep}{ms:03d}"
+
+
+# Un cue SRT/WebVTT (stessa struttura, cambia solo il separatore dei millisecondi)
+_CUE_TEMPLATE = "{index}\n{start} --> {end}\n{text}\n\n"
+
+
+def _render_cues(subtitles, sep=','):
+    """Concatena i cue in una sola stringa (un'unica allocazione finale)."""
+    return "".join([
+        _CUE_TEMPLATE.format(index=sub['index'], start=_srt_timestamp(sub['start'], sep),
+                             end=_srt_timestamp(sub['end'], sep), text=sub['text'])
+        for sub in subtitles
+    ])
+
+
+_observer = None
+_observer_lock = threading.Lock()
+
+
+def _get_observer():
+    """Observer watchdog condiviso da tutte le sessioni (un solo thread)."""
+    global _observer
+    with _observer_lock:
+        if _observer is None:
+            _observer = Observer()
+            _observer.daemon = True
+            _observer.start()
+        return _observer
+
+
+# Un solo watch per directory, mai rimosso: watchdog identifica i watch per
+# (percorso, ricorsivo), quindi l'unschedule di una sessione toglierebbe anche
+# gli handler delle altre sessioni sulla stessa directory. Il dispatcher
+# inoltra gli eventi alla sessione proprietaria del file
+_srt_events = {}  # percorso SRT assoluto -> Event della sessione
+_watched_dirs = set()
+_watch_lock = threading.Lock()
+
+
+def _dispatch_srt_event(event):
+    for path in (event.src_path, getattr(event, 'dest_path', None)):
+        changed = _srt_events.get(path)
+        if changed is not None:
+            changed.set()
+
+
+if HAS_WATCHDOG:
+    class _SrtDispatcher(FileSystemEventHandler):
+        def on_any_event(self, event):
+            _dispatch_srt_event(event)
+
+
+def _watch_srt(path, changed):
+    """Registra l'Event da impostare alle modifiche di path. False se watchdog non è utilizzabile."""
+    if not HAS_WATCHDOG:
+        return False
+    directory = os.path.dirname(path)
+    with _watch_lock:
+        if directory not in _watched_dirs:
+            try:
+                _get_observer().schedule(_SrtDispatcher(), directory)
+            except OSError as e:
+                print(f"watchdog non disponibile per {directory}, uso polling: {e}")
+                return False
+            _watched_dirs.add(directory)
+        _srt_events[path] = changed
+    return True
+
+
+def _unwatch_srt(path):
+    with _watch_lock:
+        _srt_events.pop(path, None)
+
+
+# Cache LRU delle traduzioni condivisa tra le sessioni: (testo, lingua) -> traduzione
+TRANSLATION_CACHE_MAX = 10000
+_translation_cache = OrderedDict()
+_translation_cache_lock = threading.Lock()
+
+
+def _get_cached_translation(text, dest):
+    """Traduzione in cache di text verso dest, o None."""
+    key = (text, dest)
+    with _translation_cache_lock:
+        translated = _translation_cache.get(key)
+        if translated is not None:
+            _translation_cache.move_to_end(key)
+        return translated
+
+
+def _put_cached_translation(text, dest, translated):
+    """Memorizza una traduzione, eliminando la meno usata oltre TRANSLATION_CACHE_MAX."""
+    with _translation_cache_lock:
+        _translation_cache[(text, dest)] = translated
+        _translation_cache.move_to_end((text, dest))
+        if len(_translation_cache) > TRANSLATION_CACHE_MAX:
+            _translation_cache.popitem(last=False)
+
+
+# Varianti quantizzate di whisper.cpp preferite se presenti: pesi più piccoli,
+# meno banda di memoria per passo e caricamento più rapido (PREFER_QUANTIZED=0 per disattivare)
+PREFER_QUANTIZED = os.environ.get('PREFER_QUANTIZED', '1') != '0'
+QUANTIZED_SUFFIXES = ("q5_1", "q5_0", "q8_0", "q4_0")
+
+
+# Traduttori opzionali: prima googletrans, poi fallback a deep-translator
+try:
+    from googletrans import Translator as _GoogletransTranslator
+    HAS_GOOGLETRANS = True
+except (ImportError, AttributeError):
+    HAS_GOOGLETRANS = False
+try:
+    from deep_translator import GoogleTranslator as _DeepGoogleTranslator
+    HAS_DEEP_TRANSLATOR = True
+except ImportError:
+    HAS_DEEP_TRANSLATOR = False
+
+_translators = {}  # lingua di destinazione -> (traduttore, tipo)
+_translators_lock = threading.Lock()
+
+
+def _get_translator(dest):
+    """
+    Traduttore per la lingua dest, creato alla prima richiesta e poi riusato da
+    tutte le sessioni: client HTTP e token non vengono ricreati a ogni
+    aggiornamento dell'SRT.
+    
+    Returns:
+        (traduttore, 'googletrans' o 'deep-translator')
+    """
+    with _translators_lock:
+        entry = _translators.get(dest)
+        if entry is None:
+            if HAS_GOOGLETRANS:
+                entry = (_GoogletransTranslator(), 'googletrans')  # Lingua passata a ogni chiamata
+                print(f"✅ Usando googletrans per traduzione in {dest}")
+            elif HAS_DEEP_TRANSLATOR:
+                entry = (_DeepGoogleTranslator(source='auto', target=dest), 'deep-translator')
+                print(f"✅ Usando deep-translator per traduzione in {dest}")
+            else:
+                print("❌ Né googletrans né deep-translator disponibili")
+                raise ImportError("Nessun traduttore disponibile")
+            _translators[dest] = entry
+        return entry
+
+
+# Richieste di traduzione parallele quando il batch non è disponibile
+# (limite basso per non incorrere nel rate limit di Google Translate)
+TRANSLATE_WORKERS = 8
+
+
+def _translate_one(text, translator, translator_type, dest):
+    """Traduce un singolo testo con googletrans o deep-translator."""
+    if translator_type == 'googletrans':
+        translated = translator.translate(text, dest=dest)
+        return translated.text if hasattr(translated, 'text') else str(translated)
+    return translator.translate(text)  # deep-translator
+
+
+def _find_model(model_name):
+    """
+    Cerca il modello Whisper (whisper.cpp usa .bin, non .pt).
+    I modelli sono in formato ggml-{model}.bin o {model}.bin, oppure
+    ggml-{model}-{quantizzazione}.bin per le varianti quantizzate
+    """
+    possible_paths = []
+    if PREFER_QUANTIZED:
+        for suffix in QUANTIZED_SUFFIXES:
+            possible_paths.append(os.path.expanduser(f"~/.cache/whisper/ggml-{model_name}-{suffix}.bin"))
+            possible_paths.append(f"/opt/homebrew/opt/whisper-cpp/share/whisper-cpp/ggml-{model_name}-{suffix}.bin")
+    possible_paths += [
+        # Prova prima il formato semplice (base.bin)
+        os.path.expanduser(f"~/.cache/whisper/{model_name}.bin"),
+        # Poi il formato ggml- (ggml-base.bin)
+        os.path.expanduser(f"~/.cache/whisper/ggml-{model_name}.bin"),
+        os.path.expanduser(f"~/.cache/whisper/{model_name}.ggml"),
+        os.path.expanduser(f"~/.local/share/whisper/{model_name}.bin"),
+        f"/opt/homebrew/opt/whisper-cpp/share/whisper-cpp/{model_name}.bin",
+        f"/opt/homebrew/opt/whisper-cpp/share/whisper-cpp/ggml-{model_name}.bin",
+        # Modello di test (se disponibile)
+        f"/opt/homebrew/opt/whisper-cpp/share/whisper-cpp/for-tests-ggml-tiny.bin" if model_name == "tiny" else None,
+    ]
+    for path in possible_paths:
+        if path and os.path.exists(path):
+            return path
+    return None
+
+
+# Modelli da portare in page cache all'avvio (separati da virgola, vuoto per disattivare)
+WARM_WHISPER_MODELS = os.environ.get('WARM_WHISPER_MODELS', 'base')
+_warm_models = []  # mmap tenuti aperti: le pagine restano associate al processo
+
+
+def _warm_model_files(model_names):
+    """
+    Legge in page cache i file dei modelli tramite mmap: il filtro Whisper di
+    FFmpeg della prima sessione trova i pesi già in memoria invece che su disco.
+    """
+    page = mmap.PAGESIZE
+    for model_name in model_names:
+        model_path = _find_model(model_name)
+        if not model_path:
+            continue
+        try:
+            with open(model_path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_WILLNEED'):
+                mm.madvise(mmap.MADV_WILLNEED)
+            for off in range(0, len(mm), page):
+                mm[off]  # Tocca una pagina: la porta in page cache
+            _warm_models.append(mm)
+            print(f"✓ Modello {model_name} in page cache: {model_path}")
+        except (OSError, ValueError) as e:
+            print(f"Impossibile precaricare il modello {model_name}: {e}")
+
+
+if HAS_WHISPER_FILTER and WARM_WHISPER_MODELS:
+    # In background: l'avvio del server non attende la lettura dei file
+    threading.Thread(
+        target=_warm_model_files,
+        args=([m.strip() for m in WARM_WHISPER_MODELS.split(',') if m.strip()],),
+        daemon=True
+    ).start()
+
+
 class SimpleVideoSession:
     """Sessione semplificata per trascrizione video."""
     
@@ -154,17 +547,42 @@ class SimpleVideoSession:
         
         # Processo FFmpeg
         self.ffmpeg_process = None
+        self._holds_slot = False  # True se occupa uno slot di _ffmpeg_slots
+        self.ready_event = threading.Event()  # FFmpeg ha iniziato a elaborare
+        self.failed_event = threading.Event()  # Lo stderr di FFmpeg è stato chiuso (processo terminato)
+        self._stderr_lines = deque(maxlen=200)  # Ultime righe stderr per i messaggi di errore
+        self._slot_lock = threading.Lock()
         self.running = False
         self.status = "initializing"
         self.error = None
         
         # Sottotitoli
-        self.all_subtitles = []
-        self.translated_subtitles = []  # Sottotitoli tradotti
+        # In memoria solo gli ultimi MAX_SUBTITLES: lo storico completo resta nel file SRT
+        self.all_subtitles = deque(maxlen=MAX_SUBTITLES)
+        self.translated_subtitles = deque(maxlen=MAX_SUBTITLES)  # Sottotitoli tradotti
+        self._subtitle_count = 0  # Sottotitoli letti in totale (anche quelli usciti dal buffer)
+        self._translated_count = 0  # Sottotitoli tradotti in totale
+        # Versione dei sottotitoli tradotti (cresce a ogni modifica) e SRT già renderizzato
+        self.subtitles_version = 0
+        self.srt_generation = 0  # Cresce quando l'SRT è riscritto da capo (indici ripartono)
+        self._srt_cues = deque(maxlen=MAX_SUBTITLES)  # Cue SRT già formattati (bytes UTF-8), allineati ai tradotti
+        self._srt_cache = None
+        self._srt_cache_version = -1
+        self._srt_comma = None  # True se l'SRT usa già la virgola nei timestamp (None: non ancora noto)
+        
+        # Ultima richiesta di un client (stream, stato, sottotitoli): base per l'eviction
+        self.last_activity = time.monotonic()
+        
+        # Lettura incrementale dell'SRT: si analizzano solo i byte aggiunti
+        self._srt_offset = 0  # Byte del file SRT già letti
+        self._srt_tail = b""  # Ultimo blocco ancora incompleto
+        self._srt_head = b""  # Primi byte letti: se cambiano, il file è stato riscritto
+        self._last_srt_stat = None  # (st_mtime_ns, st_size) all'ultima lettura
+        self._srt_changed = threading.Event()  # Impostato da watchdog a ogni modifica
         
         # Crea SRT iniziale
-        with open(self.srt_path, 'w', encoding='utf-8') as f:
-            f.write("1\n00:00:00,000 --> 00:00:01,000\nCaricamento...\n\n")
+        with open(self.srt_path, 'wb') as f:
+            f.write(_SRT_PLACEHOLDER)
     
     def start(self):
         """Avvia FFmpeg con filtro Whisper per trascrizione + burn-in + streaming."""
@@ -183,34 +601,18 @@ class SimpleVideoSession:
             # Per ora, usiamo il nome del modello e FFmpeg lo cercherà automaticamente
             # Se non funziona, dobbiamo specificare il percorso completo
             
-            # Cerca il modello Whisper (whisper.cpp usa .bin, non .pt)
-            # I modelli sono in formato ggml-{model}.bin o {model}.bin
-            model_path = None
             model_name = self.model
-            possible_paths = [
-                # Prova prima il formato semplice (base.bin)
-                os.path.expanduser(f"~/.cache/whisper/{model_name}.bin"),
-                # Poi il formato ggml- (ggml-base.bin)
-                os.path.expanduser(f"~/.cache/whisper/ggml-{model_name}.bin"),
-                os.path.expanduser(f"~/.cache/whisper/{model_name}.ggml"),
-                os.path.expanduser(f"~/.local/share/whisper/{model_name}.bin"),
-                f"/opt/homebrew/opt/whisper-cpp/share/whisper-cpp/{model_name}.bin",
-                f"/opt/homebrew/opt/whisper-cpp/share/whisper-cpp/ggml-{model_name}.bin",
-                # Modello di test (se disponibile)
-                f"/opt/homebrew/opt/whisper-cpp/share/whisper-cpp/for-tests-ggml-tiny.bin" if model_name == "tiny" else None,
-            ]
-            
-            for path in possible_paths:
-                if path and os.path.exists(path):
-                    model_path = path
-                    print(f"[Session {self.session_id}] ✓ Modello trovato: {model_path}")
-                    break
+            model_path = _find_model(model_name)
+            if model_path:
+                print(f"[Session {self.session_id}] ✓ Modello trovato: {model_path}")
             
             # Se non trovato, mostra messaggio di errore chiaro
             if not model_path:
                 error_msg = f"Modello Whisper '{model_name}' non trovato!\n"
                 error_msg += f"Scarica i modelli whisper.cpp eseguendo:\n"
                 error_msg += f"  cd /Users/ube/vls-speech2text && ./download_whisper_models.sh\n"
+                error_msg += f"Per le varianti quantizzate (più veloci su CPU):\n"
+                error_msg += f"  QUANT=q5_1 ./download_whisper_models.sh\n"
                 error_msg += f"Oppure manualmente da:\n"
                 error_msg += f"  https://huggingface.co/ggerganov/whisper.cpp/tree/main"
                 print(f"[Session {self.session_id}] ❌ {error_msg}")
@@ -227,21 +629,14 @@ class SimpleVideoSession:
             # Comando FFmpeg semplificato:
             # - Legge video
             # - Trascrive con Whisper (genera SRT)
-            # - Applica sottotitoli burn-in
+            # - Video copiato così com'è (niente burn-in: i sottotitoli sono serviti come WebVTT)
             # - Streama via HTTP
             # NOTA: Non possiamo usare -c:a copy con un filtro audio, dobbiamo usare un codec
             ffmpeg_cmd = [
                 FFMPEG_PATH,
                 "-i", self.video_url,
                 "-af", whisper_filter,  # Trascrizione Whisper
-                # NOTA: Il filtro subtitles non è disponibile in questa versione di FFmpeg
-                # Per ora, non applichiamo burn-in (i sottotitoli saranno disponibili come file SRT separato)
-                # TODO: Convertire SRT in ASS e usare filtro ass, oppure usare drawtext
-                "-c:v", "libx264",
-                "-preset", "ultrafast",
-                "-tune", "zerolatency",
-                "-g", "30",  # GOP size per frammentazione
-                "-sc_threshold", "0",  # Disabilita scene change detection
+                *VIDEO_CODEC_ARGS,
                 "-c:a", "aac",  # Deve essere aac, non copy (il filtro richiede ri-encoding)
                 "-b:a", "128k",
                 "-ac", "2",  # Forza stereo (2 canali) per compatibilità AAC
@@ -254,77 +649,94 @@ class SimpleVideoSession:
             ]
             
             print(f"[Session {self.session_id}] Avvio FFmpeg con Whisper...")
-            print(f"Comando completo: {' '.join(ffmpeg_cmd)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Comando completo: %s", shlex.join(ffmpeg_cmd))
             
             self.ffmpeg_process = subprocess.Popen(
                 ffmpeg_cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                bufsize=0
+                bufsize=0,
+                env=FFMPEG_ENV
             )
+            stderr_fd = self.ffmpeg_process.stderr.fileno()
+            os.set_blocking(stderr_fd, False)
             
             # Thread per log stderr (per debug) - log TUTTO
+            # Segnala anche l'avvio: "Stream mapping"/"Press [q]" compaiono quando
+            # FFmpeg ha aperto input e output; EOF significa che il processo è terminato
+            def handle_line(line):
+                decoded = line.decode('utf-8', errors='ignore').strip()
+                if not decoded:
+                    return
+                self._stderr_lines.append(decoded)
+                # Log tutto per debug
+                print(f"[FFmpeg {self.session_id}] {decoded}")
+                if not self.ready_event.is_set() and (b"Stream mapping" in line or b"Press [q]" in line):
+                    self.ready_event.set()
+            
             def log_stderr():
+                # Unico lettore dello stderr: blocchi da 4KB quando il selector segnala
+                # dati (la pipe è non bloccante), divisi in righe su '\n' e '\r'
+                selector = selectors.DefaultSelector()
+                selector.register(stderr_fd, selectors.EVENT_READ)
+                pending = b""
                 try:
-                    for line in iter(self.ffmpeg_process.stderr.readline, b''):
-                        if line:
-                            decoded = line.decode('utf-8', errors='ignore').strip()
-                            # Log tutto per debug
-                            print(f"[FFmpeg {self.session_id}] {decoded}")
+                    while True:
+                        selector.select()
+                        try:
+                            data = os.read(stderr_fd, 4096)
+                        except BlockingIOError:
+                            continue
+                        if not data:
+                            break
+                        lines = _LINE_SPLIT_RE.split(pending + data)
+                        pending = lines.pop()
+                        for line in lines:
+                            handle_line(line)
+                    if pending:
+                        handle_line(pending)
                 except Exception as e:
                     print(f"[FFmpeg {self.session_id}] Errore log stderr: {e}")
+                finally:
+                    selector.close()
+                    self.failed_event.set()
+                    self.ready_event.set()  # Sveglia start() se sta ancora attendendo
             
             stderr_thread = threading.Thread(target=log_stderr, daemon=True)
             stderr_thread.start()
             
-            # Aspetta un po' per vedere se FFmpeg si avvia correttamente
-            print(f"[Session {self.session_id}] Attendo 3 secondi per verifica avvio FFmpeg...")
-            time.sleep(3)
-            exit_code = self.ffmpeg_process.poll()
+            # Lo slot si libera anche quando FFmpeg termina da solo (fine video)
+            def release_on_exit(process=self.ffmpeg_process):
+                process.wait()
+                self.release_slot()
+            
+            threading.Thread(target=release_on_exit, daemon=True).start()
+            
+            # Attendi che FFmpeg sia operativo o termini (al massimo STARTUP_TIMEOUT secondi)
+            print(f"[Session {self.session_id}] Attendo avvio FFmpeg...")
+            if not self.ready_event.wait(timeout=STARTUP_TIMEOUT):
+                print(f"[Session {self.session_id}] Nessun segnale di avvio da FFmpeg dopo {STARTUP_TIMEOUT}s, proseguo")
+            exit_code = None
+            if self.failed_event.is_set():
+                try:
+                    exit_code = self.ffmpeg_process.wait(timeout=1)
+                except subprocess.TimeoutExpired:
+                    pass
             if exit_code is not None:
                 # FFmpeg è terminato subito, c'è un errore
                 print(f"[Session {self.session_id}] FFmpeg terminato con exit code: {exit_code}")
                 
-                # Prova a leggere tutto lo stderr disponibile
-                stderr_output = ""
-                try:
-                    # Leggi tutto quello che c'è nello stderr
-                    import select
-                    import fcntl
-                    
-                    # Imposta stderr come non bloccante
-                    if sys.platform != 'win32':
-                        flags = fcntl.fcntl(self.ffmpeg_process.stderr, fcntl.F_GETFL)
-                        fcntl.fcntl(self.ffmpeg_process.stderr, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-                    
-                    # Leggi tutto lo stderr disponibile
-                    chunks = []
-                    while True:
-                        try:
-                            chunk = self.ffmpeg_process.stderr.read(4096)
-                            if not chunk:
-                                break
-                            chunks.append(chunk)
-                        except:
-                            break
-                    
-                    if chunks:
-                        stderr_output = b''.join(chunks).decode('utf-8', errors='ignore')
-                    else:
-                        stderr_output = "Nessun output stderr disponibile (processo terminato prima di generare output)"
-                        
-                except Exception as e:
-                    stderr_output = f"Errore lettura stderr: {e}"
-                    import traceback
-                    traceback.print_exc()
-                
                 # Mostra le ultime righe dello stderr (dove di solito c'è l'errore)
-                stderr_lines = stderr_output.split('\n')
-                last_lines = '\n'.join(stderr_lines[-30:]) if len(stderr_lines) > 30 else stderr_output
+                stderr_thread.join(timeout=1)
+                if self._stderr_lines:
+                    last_lines = '\n'.join(list(self._stderr_lines)[-30:])
+                else:
+                    last_lines = "Nessun output stderr disponibile (processo terminato prima di generare output)"
                 
                 error_msg = f"FFmpeg terminato (exit code: {exit_code}):\n{last_lines[:2000]}"
                 print(f"[Session {self.session_id}] ERRORE: {error_msg}")
-                print(f"[Session {self.session_id}] Comando eseguito: {' '.join(ffmpeg_cmd)}")
+                logger.error("[Session %s] Comando eseguito: %s", self.session_id, shlex.join(ffmpeg_cmd))
                 self.error = error_msg
                 self.status = "error"
                 raise Exception(error_msg)
@@ -342,129 +754,190 @@ class SimpleVideoSession:
             self.status = "error"
             self.error = str(e)
             print(f"Errore avvio sessione: {e}")
+            self.release_slot()
             return False
     
     def _monitor_srt(self):
-        """Monitora il file SRT generato da Whisper."""
-        import re
-        last_size = 0
-        check_count = 0
-        
+        """
+        Monitora il file SRT generato da Whisper. Con watchdog il thread dorme
+        finché il file non viene modificato (con un controllo di sicurezza ogni
+        2 secondi); senza, controlla ogni secondo.
+        """
         print(f"[Session {self.session_id}] Avvio monitoraggio SRT: {self.srt_path}")
         
-        while self.running:
-            try:
-                check_count += 1
-                if os.path.exists(self.srt_path):
-                    size = os.path.getsize(self.srt_path)
-                    if size != last_size:
-                        print(f"[Session {self.session_id}] File SRT modificato: {size} bytes (era {last_size})")
-                        try:
-                            with open(self.srt_path, 'r', encoding='utf-8') as f:
-                                content = f.read()
-                            
-                            if content.strip():
-                                # Parse SRT - pattern migliorato per gestire formati diversi
-                                # Supporta sia formato con virgola che con punto nei timestamp
-                                pattern = r'(\d+)\s+(\d{2}):(\d{2}):(\d{2})[,.](\d{3})\s+-->\s+(\d{2}):(\d{2}):(\d{2})[,.](\d{3})\s+(.+?)(?=\n\d+\s+\d{2}:|\Z)'
-                                matches = re.findall(pattern, content, re.DOTALL)
-                                
-                                # Se non trova match, prova pattern alternativo (senza virgola/punto)
-                                if not matches:
-                                    pattern2 = r'(\d+)\s+(\d{2}):(\d{2}):(\d{2}),(\d{3})\s+-->\s+(\d{2}):(\d{2}):(\d{2}),(\d{3})\s+(.+?)(?=\n\n|\Z)'
-                                    matches = re.findall(pattern2, content, re.DOTALL)
-                                
-                                print(f"[Session {self.session_id}] Pattern trovati {len(matches)} match in SRT (dimensione: {len(content)} chars)")
-                                
-                                self.all_subtitles = []
-                                for m in matches:
-                                    idx = int(m[0])
-                                    start = int(m[1])*3600 + int(m[2])*60 + int(m[3]) + int(m[4])/1000.0
-                                    end = int(m[5])*3600 + int(m[6])*60 + int(m[7]) + int(m[8])/1000.0
-                                    text = m[9].strip()
-                                    
-                                    self.all_subtitles.append({
-                                        'index': idx,
-                                        'start': start,
-                                        'end': end,
-                                        'text': text
-                                    })
-                                
-                                if self.all_subtitles:
-                                    print(f"[Session {self.session_id}] Trovati {len(self.all_subtitles)} sottotitoli nel file SRT")
-                                    
-                                    # Traduci i sottotitoli se richiesto
-                                    print(f"[Session {self.session_id}] 🔍 Controllo traduzione: translate_to={self.translate_to}, all_subtitles={len(self.all_subtitles)}")
-                                    if self.translate_to and self.translate_to != 'none':
-                                        print(f"[Session {self.session_id}] ✅ Chiamata traduzione...")
-                                        self._translate_subtitles()
-                                    else:
-                                        print(f"[Session {self.session_id}] ⚠️ Traduzione non richiesta (translate_to={self.translate_to})")
-                        except Exception as e:
-                            print(f"[Session {self.session_id}] Errore lettura/parsing SRT: {e}")
+        srt_path = os.path.abspath(self.srt_path)
+        watched = _watch_srt(srt_path, self._srt_changed)
+        
+        try:
+            while self.running:
+                try:
+                    new_subtitles = self._read_srt_updates()
+                    if new_subtitles:
+                        self.all_subtitles.extend(new_subtitles)
+                        self._subtitle_count += len(new_subtitles)
+                        print(f"[Session {self.session_id}] Trovati {self._subtitle_count} sottotitoli nel file SRT")
                         
-                        last_size = size
-                else:
-                    if check_count % 10 == 0:  # Log ogni 10 controlli
-                        print(f"[Session {self.session_id}] File SRT non ancora creato: {self.srt_path}")
+                        # Traduci i sottotitoli se richiesto
+                        if self.translate_to and self.translate_to != 'none':
+                            self._translate_subtitles()
+                except Exception as e:
+                    print(f"[Session {self.session_id}] Errore lettura/parsing SRT: {e}")
+                    import traceback
+                    traceback.print_exc()
                 
-                time.sleep(1)
-            except Exception as e:
-                print(f"[Session {self.session_id}] Errore monitoraggio SRT: {e}")
-                import traceback
-                traceback.print_exc()
-                time.sleep(2)
+                # Con watchdog risveglio su modifica o stop(); il timeout copre eventi persi
+                self._srt_changed.wait(2 if watched else 1)
+                self._srt_changed.clear()
+        finally:
+            if watched:
+                _unwatch_srt(srt_path)
+    
+    def _read_srt_updates(self):
+        """
+        Legge dal file SRT solo i byte aggiunti dall'ultima lettura e ritorna i
+        sottotitoli dei blocchi completati. Un blocco finale senza riga vuota
+        resta in attesa del resto. Se il file è stato troncato o riscritto
+        (FFmpeg sostituisce il segnaposto iniziale) riparte da capo.
+        """
+        # Un solo stat: se mtime e dimensione non cambiano non apre nemmeno il file
+        # (mtime_ns coglie anche le riscritture che lasciano invariata la dimensione)
+        try:
+            st = os.stat(self.srt_path)
+        except FileNotFoundError:
+            return []
+        if (st.st_mtime_ns, st.st_size) == self._last_srt_stat:
+            return []
+        
+        try:
+            with open(self.srt_path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                self._last_srt_stat = (st.st_mtime_ns, st.st_size)
+                size = st.st_size
+                head = f.read(len(self._srt_head))
+                if size < self._srt_offset or head != self._srt_head:
+                    print(f"[Session {self.session_id}] File SRT riscritto, rilettura da capo")
+                    self._srt_offset = 0
+                    self._srt_tail = b""
+                    self._srt_head = b""
+                    self.all_subtitles.clear()
+                    self.translated_subtitles.clear()
+                    self._srt_cues.clear()
+                    self._subtitle_count = 0
+                    self._translated_count = 0
+                    self.subtitles_version += 1
+                    self._srt_comma = None  # Il nuovo file può usare un altro separatore
+                    self.srt_generation += 1
+                if size == self._srt_offset:
+                    return []
+                f.seek(self._srt_offset)
+                data = f.read(size - self._srt_offset)
+        except FileNotFoundError:
+            return []
+        
+        if len(self._srt_head) < 64:
+            self._srt_head = (self._srt_head + data)[:64]
+        self._srt_offset += len(data)
+        
+        buffer = self._srt_tail + data
+        end = buffer.rfind(b"\n\n")
+        if end < 0:
+            self._srt_tail = buffer
+            return []
+        content = buffer[:end + 2].decode('utf-8', errors='ignore')
+        self._srt_tail = buffer[end + 2:]
+        
+        subtitles = []
+        for m in _SRT_RE.finditer(content):
+            subtitles.append({
+                'index': int(m['idx']),
+                'start': _srt_seconds(m['h1'], m['m1'], m['s1'], m['ms1']),
+                'end': _srt_seconds(m['h2'], m['m2'], m['s2'], m['ms2']),
+                'text': m['text'].strip()
+            })
+        return subtitles
+    
+    def _add_translated(self, subtitle):
+        """
+        Registra un sottotitolo tradotto e ne formatta subito il cue SRT: la
+        formattazione (e la codifica UTF-8) avviene una volta all'arrivo, non a
+        ogni GET dei sottotitoli.
+        """
+        self.translated_subtitles.append(subtitle)
+        self._srt_cues.append(_render_cues((subtitle,)).encode('utf-8'))
+        self._translated_count += 1
+        self.subtitles_version += 1
     
     def _translate_subtitles(self):
         """Traduce i sottotitoli nella lingua specificata."""
-        print(f"[Session {self.session_id}] 🔍 _translate_subtitles chiamato: translate_to={self.translate_to}, all_subtitles={len(self.all_subtitles)}, translated={len(self.translated_subtitles)}")
+        print(f"[Session {self.session_id}] 🔍 _translate_subtitles chiamato: translate_to={self.translate_to}, all_subtitles={self._subtitle_count}, translated={self._translated_count}")
         
         if not self.translate_to or self.translate_to == 'none':
             print(f"[Session {self.session_id}] ⚠️ Traduzione disabilitata (translate_to={self.translate_to})")
             return
         
         try:
-            # Prova prima googletrans, poi fallback a deep-translator se non funziona
-            translator = None
-            translator_type = None
-            try:
-                from googletrans import Translator
-                translator = Translator()
-                translator_type = 'googletrans'
-                print(f"[Session {self.session_id}] ✅ Usando googletrans per traduzione")
-            except (ImportError, ModuleNotFoundError, AttributeError) as e:
-                print(f"[Session {self.session_id}] ⚠️ googletrans non disponibile ({type(e).__name__}: {e}), provo deep-translator...")
-                try:
-                    from deep_translator import GoogleTranslator
-                    translator = GoogleTranslator(source='auto', target=self.translate_to)
-                    translator_type = 'deep-translator'
-                    print(f"[Session {self.session_id}] ✅ Usando deep-translator per traduzione")
-                except ImportError:
-                    print(f"[Session {self.session_id}] ❌ Né googletrans né deep-translator disponibili")
-                    raise ImportError("Nessun traduttore disponibile")
+            # Traduttore condiviso (creato una sola volta per lingua di destinazione)
+            translator, translator_type = _get_translator(self.translate_to)
             
             # Traduci solo i nuovi sottotitoli (quelli non ancora tradotti)
-            new_subtitles = self.all_subtitles[len(self.translated_subtitles):]
+            # (i contatori totali, non len(): la deque smette di crescere a MAX_SUBTITLES)
+            new_subtitles = _tail(self.all_subtitles, self._subtitle_count - self._translated_count)
             
             if not new_subtitles:
-                print(f"[Session {self.session_id}] Nessun nuovo sottotitolo da tradurre (tutti già tradotti: {len(self.translated_subtitles)}/{len(self.all_subtitles)})")
+                print(f"[Session {self.session_id}] Nessun nuovo sottotitolo da tradurre (tutti già tradotti: {self._translated_count}/{self._subtitle_count})")
                 return
             
             print(f"[Session {self.session_id}] 🔄 Traduzione di {len(new_subtitles)} sottotitoli in {self.translate_to}...")
             print(f"[Session {self.session_id}] Esempio primo sottotitolo da tradurre: '{new_subtitles[0]['text'][:50]}...'")
             
-            for subtitle in new_subtitles:
+            # Frasi già tradotte (anche in altre sessioni) non tornano al servizio
+            texts = [subtitle['text'] for subtitle in new_subtitles]
+            translated_texts = [_get_cached_translation(text, self.translate_to) for text in texts]
+            miss_texts = list(dict.fromkeys(
+                text for text, translated in zip(texts, translated_texts) if translated is None
+            ))
+            
+            # Una sola richiesta per tutti i testi mancanti invece di una per testo
+            if miss_texts:
                 try:
-                    # Traduci il testo
-                    print(f"[Session {self.session_id}] Traduco: '{subtitle['text'][:50]}...' -> {self.translate_to} (tipo: {translator_type})")
-                    
                     if translator_type == 'googletrans':
-                        translated = translator.translate(subtitle['text'], dest=self.translate_to)
-                        translated_text = translated.text if hasattr(translated, 'text') else str(translated)
+                        results = translator.translate(miss_texts, dest=self.translate_to)
+                        results = [r.text if hasattr(r, 'text') else str(r) for r in results]
                     else:  # deep-translator
-                        translated_text = translator.translate(subtitle['text'])
-                    
-                    print(f"[Session {self.session_id}] ✅ Risultato: '{translated_text[:50]}...'")
+                        results = translator.translate_batch(miss_texts)
+                    if len(results) != len(miss_texts):
+                        raise ValueError(f"{len(results)} risultati per {len(miss_texts)} testi")
+                    batch = dict(zip(miss_texts, results))
+                    for text, translated in batch.items():
+                        _put_cached_translation(text, self.translate_to, translated)
+                    translated_texts = [translated if translated is not None else batch[text]
+                                        for text, translated in zip(texts, translated_texts)]
+                except Exception as e:
+                    print(f"[Session {self.session_id}] ⚠️ Traduzione batch fallita ({e}), traduco un sottotitolo alla volta")
+            
+            # Testi rimasti senza traduzione (batch non riuscito): una richiesta per
+            # testo, ma in parallelo così le latenze di rete si sovrappongono
+            pending = [i for i, translated in enumerate(translated_texts) if translated is None]
+            errors = {}
+            if pending:
+                def translate_pending(i):
+                    try:
+                        translated = _translate_one(texts[i], translator, translator_type, self.translate_to)
+                        _put_cached_translation(texts[i], self.translate_to, translated)
+                        return translated
+                    except Exception as e:
+                        errors[i] = e
+                        return None
+                
+                with ThreadPoolExecutor(max_workers=min(TRANSLATE_WORKERS, len(pending))) as executor:
+                    for i, translated in zip(pending, executor.map(translate_pending, pending)):
+                        translated_texts[i] = translated
+            
+            for i, subtitle in enumerate(new_subtitles):
+                try:
+                    translated_text = translated_texts[i]
+                    if translated_text is None:
+                        raise errors.get(i) or ValueError("traduzione mancante")
                     
                     translated_subtitle = {
                         'index': subtitle['index'],
@@ -472,18 +945,18 @@ class SimpleVideoSession:
                         'end': subtitle['end'],
                         'text': translated_text
                     }
-                    self.translated_subtitles.append(translated_subtitle)
+                    self._add_translated(translated_subtitle)
                     
-                    if len(self.translated_subtitles) <= 5:  # Log i primi 5
+                    if self._translated_count <= 5:  # Log i primi 5
                         print(f"[Session {self.session_id}] 📝 Tradotto #{subtitle['index']}: '{subtitle['text'][:40]}...' -> '{translated_text[:40]}...'")
                 except Exception as e:
                     print(f"[Session {self.session_id}] ❌ Errore traduzione sottotitolo {subtitle['index']}: {e}")
                     import traceback
                     traceback.print_exc()
                     # In caso di errore, usa il testo originale
-                    self.translated_subtitles.append(subtitle)
+                    self._add_translated(subtitle)
             
-            print(f"[Session {self.session_id}] ✅ Traduzione completata: {len(self.translated_subtitles)}/{len(self.all_subtitles)} sottotitoli tradotti")
+            print(f"[Session {self.session_id}] ✅ Traduzione completata: {self._translated_count}/{self._subtitle_count} sottotitoli tradotti")
             
         except ImportError:
             print(f"[Session {self.session_id}] ⚠️ googletrans non installato. Installa con: pip install googletrans==4.0.0rc1")
@@ -492,9 +965,21 @@ class SimpleVideoSession:
             import traceback
             traceback.print_exc()
     
+    def touch(self):
+        """Registra attività di un client sulla sessione."""
+        self.last_activity = time.monotonic()
+    
+    def release_slot(self):
+        """Restituisce lo slot FFmpeg occupato dalla sessione (una sola volta)."""
+        with self._slot_lock:
+            if self._holds_slot:
+                self._holds_slot = False
+                _ffmpeg_slots.release()
+    
     def stop(self):
         """Ferma la sessione."""
         self.running = False
+        self._srt_changed.set()  # Sveglia il monitor SRT perché termini
         if self.ffmpeg_process:
             try:
                 self.ffmpeg_process.terminate()
@@ -504,6 +989,7 @@ class SimpleVideoSession:
                     self.ffmpeg_process.kill()
                 except:
                     pass
+        self.release_slot()
     
     def cleanup(self):
         """Pulisce risorse."""
@@ -515,6 +1001,15 @@ class SimpleVideoSession:
             pass
 
 
+def json_response(obj, status=200):
+    """Equivalente di jsonify, serializzato con orjson se installato."""
+    if HAS_ORJSON:
+        body = orjson.dumps(obj)
+    else:
+        body = json.dumps(obj).encode('utf-8')
+    return Response(body, status=status, mimetype='application/json')
+
+
 @app.route('/')
 def index():
     """Pagina principale."""
@@ -586,12 +1081,22 @@ def start_session():
     
     print(f"[Start] Nuova sessione: video_url={video_url}, language={language}, model={model}, translate_to={translate_to}")
     
-    session_counter += 1
-    session_id = f"session_{session_counter}"
+    # Limita i processi FFmpeg+Whisper contemporanei
+    if not _ffmpeg_slots.acquire(blocking=False):
+        return jsonify({
+            'error': f'Troppe sessioni attive (max {MAX_FFMPEG_WORKERS}). Riprova più tardi.'
+        }), 503
+    
+    # Incremento e registrazione atomici: richieste concorrenti non ottengono lo stesso id
+    with _sessions_lock:
+        session_counter += 1
+        session_id = f"session_{session_counter}"
     
     print(f"[Start] Creazione sessione {session_id}...")
     session = SimpleVideoSession(session_id, video_url, language, model, translate_to=translate_to)
-    sessions[session_id] = session
+    session._holds_slot = True
+    with _sessions_lock:
+        sessions[session_id] = session
     print(f"[Start] Sessione {session_id} creata e aggiunta a sessions (totale: {len(sessions)})")
     
     # Avvia in thread
@@ -606,59 +1111,77 @@ def start_session():
     return jsonify({
         'session_id': session_id,
         'stream_url': f'/api/stream/{session_id}',
-        'subtitles_url': f'/api/subtitles/{session_id}',
+        'subtitles_url': f'/api/subtitles/{session_id}.vtt',
+        'subtitles_srt_url': f'/api/subtitles/{session_id}',
         'status': 'starting'
     })
 
 
+def _set_nodelay(environ):
+    """
+    Disattiva Nagle sul socket del client, se il server WSGI lo espone
+    (server di sviluppo Werkzeug, gunicorn): ogni frammento MP4 parte subito
+    invece di attendere l'ACK del precedente. waitress lo imposta già di default.
+    """
+    sock = environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    except OSError:
+        pass
+
+
 @app.route('/api/stream/<session_id>')
 def stream_video(session_id):
     """Stream del video con sottotitoli."""
-    print(f"[Stream] Richiesta stream per sessione {session_id}")
-    print(f"[Stream] Sessioni disponibili: {list(sessions.keys())}")
+    logger.debug("[Stream] Richiesta stream per sessione %s", session_id)
     
-    if session_id not in sessions:
-        print(f"[Stream] ❌ Sessione {session_id} non trovata in sessions (disponibili: {list(sessions.keys())})")
+    session = sessions.get(session_id)
+    if session is None:
+        logger.warning("[Stream] ❌ Sessione %s non trovata", session_id)
         return "Sessione non trovata", 404
-    
-    session = sessions[session_id]
+    session.touch()
     
     if not session.ffmpeg_process:
-        print(f"[Stream] FFmpeg process non esiste per sessione {session_id}")
+        logger.warning("[Stream] FFmpeg process non esiste per sessione %s", session_id)
         return "Stream non disponibile - processo non avviato", 404
     
     poll_result = session.ffmpeg_process.poll()
     if poll_result is not None:
-        print(f"[Stream] FFmpeg process terminato (exit code: {poll_result})")
-        stderr_output = session.ffmpeg_process.stderr.read().decode('utf-8', errors='ignore') if session.ffmpeg_process.stderr else "N/A"
-        print(f"[Stream] Stderr: {stderr_output[:500]}")
+        logger.warning("[Stream] FFmpeg process terminato (exit code: %s)", poll_result)
+        # Lo stderr è letto solo dal thread di log: qui si usano le ultime righe raccolte
+        stderr_output = '\n'.join(session._stderr_lines) or "N/A"
+        logger.warning("[Stream] Stderr: %s", stderr_output[:500])
         return f"Stream non disponibile - processo terminato (exit: {poll_result})", 404
     
-    print(f"[Stream] Avvio streaming per sessione {session_id} (PID: {session.ffmpeg_process.pid})")
+    logger.info("[Stream] Avvio streaming per sessione %s (PID: %s)", session_id, session.ffmpeg_process.pid)
+    _set_nodelay(request.environ)
     
     def generate():
         """Genera stream da FFmpeg stdout."""
         bytes_sent = 0
+        # os.read sul descrittore della pipe: una syscall che restituisce direttamente
+        # il bytes da inviare (nessun buffer intermedio né copia aggiuntiva).
+        # La pipe è bloccante: os.read si sveglia appena FFmpeg scrive e ritorna
+        # b"" solo a processo chiuso, quindi niente polling con sleep
+        fd = session.ffmpeg_process.stdout.fileno()
         try:
-            while session.running and session.ffmpeg_process.poll() is None:
-                chunk = session.ffmpeg_process.stdout.read(1024 * 64)  # 64KB chunks
-                if chunk:
-                    bytes_sent += len(chunk)
-                    if bytes_sent == len(chunk):
-                        print(f"[Stream {session_id}] Primo chunk inviato ({len(chunk)} bytes)")
-                    yield chunk
-                else:
-                    # Se non ci sono dati, aspetta
-                    time.sleep(0.1)
-                    # Se non abbiamo ancora inviato nulla dopo 2 secondi, potrebbe esserci un problema
-                    if bytes_sent == 0:
-                        time.sleep(0.5)
+            while session.running:
+                chunk = os.read(fd, 1024 * 64)  # 64KB chunks
+                if not chunk:
+                    break  # EOF: FFmpeg terminato (o fermato da stop())
+                session.last_activity = time.monotonic()
+                n = len(chunk)
+                bytes_sent += n
+                if bytes_sent == n:
+                    logger.debug("[Stream %s] Primo chunk inviato (%d bytes)", session_id, n)
+                yield chunk
         except Exception as e:
-            print(f"[Stream {session_id}] Errore streaming: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("[Stream %s] Errore streaming: %s", session_id, e)
         finally:
-            print(f"[Stream {session_id}] Streaming terminato (totale: {bytes_sent} bytes)")
+            logger.info("[Stream %s] Streaming terminato (totale: %d bytes)", session_id, bytes_sent)
     
     return Response(
         stream_with_context(generate()),
@@ -667,7 +1190,9 @@ def stream_video(session_id):
             'Content-Type': 'video/mp4',
             'Cache-Control': 'no-cache',
             'X-Accel-Buffering': 'no',
-            'Accept-Ranges': 'bytes'
+            # Stream live da pipe: i byte già inviati non sono più disponibili e un MP4
+            # frammentato non è decodificabile senza l'init segment iniziale
+            'Accept-Ranges': 'none'
         }
     )
 
@@ -675,20 +1200,17 @@ def stream_video(session_id):
 @app.route('/api/subtitles/<session_id>')
 def get_subtitles(session_id):
     """Restituisce il file SRT dei sottotitoli."""
-    print(f"[Subtitles] Richiesta sottotitoli per sessione {session_id}")
+    logger.debug("[Subtitles] Richiesta sottotitoli per sessione %s", session_id)
     
-    if session_id not in sessions:
-        print(f"[Subtitles] Sessione {session_id} non trovata")
+    session = sessions.get(session_id)
+    if session is None:
+        logger.debug("[Subtitles] Sessione %s non trovata", session_id)
         return "Sessione non trovata", 404
-    
-    session = sessions[session_id]
-    
-    print(f"[Subtitles] Percorso SRT: {session.srt_path}")
-    print(f"[Subtitles] File esiste: {os.path.exists(session.srt_path)}")
+    session.touch()
     
     if not os.path.exists(session.srt_path):
         # Restituisci file SRT vuoto se non esiste ancora
-        print(f"[Subtitles] File SRT non esiste, restituisco placeholder")
+        logger.debug("[Subtitles] File SRT %s non esiste, restituisco placeholder", session.srt_path)
         return Response(
             "1\n00:00:00,000 --> 00:00:01,000\nCaricamento sottotitoli...\n\n",
             mimetype='text/srt',
@@ -701,77 +1223,135 @@ def get_subtitles(session_id):
     
     try:
         # Se ci sono sottotitoli tradotti, genera SRT da quelli, altrimenti usa il file
-        has_translated = hasattr(session, 'translated_subtitles') and session.translated_subtitles
-        translate_to = session.translate_to if hasattr(session, 'translate_to') else 'N/A'
-        translated_count = len(session.translated_subtitles) if hasattr(session, 'translated_subtitles') else 0
-        
-        print(f"[Subtitles] 🔍 Controllo: translated_subtitles={translated_count}, translate_to={translate_to}, has_translated={has_translated}")
+        has_translated = bool(session.translated_subtitles)
+        logger.debug("[Subtitles] 🔍 Controllo: translate_to=%s, has_translated=%s", session.translate_to, has_translated)
         
+        # ETag debole dalla versione dei tradotti o da (mtime, dimensione) del file:
+        # i player interrogano l'endpoint a intervalli e se nulla è cambiato ricevono 304
         if has_translated:
-            print(f"[Subtitles] ✅ Genero SRT da {len(session.translated_subtitles)} sottotitoli tradotti in {translate_to}")
-            print(f"[Subtitles] Esempio primo sottotitolo tradotto: '{session.translated_subtitles[0]['text'][:50]}...'")
-            content = ""
-            for sub in session.translated_subtitles:
-                start_h = int(sub['start'] // 3600)
-                start_m = int((sub['start'] % 3600) // 60)
-                start_s = int(sub['start'] % 60)
-                start_ms = int((sub['start'] % 1) * 1000)
-                
-                end_h = int(sub['end'] // 3600)
-                end_m = int((sub['end'] % 3600) // 60)
-                end_s = int(sub['end'] % 60)
-                end_ms = int((sub['end'] % 1) * 1000)
-                
-                content += f"{sub['index']}\n"
-                content += f"{start_h:02d}:{start_m:02d}:{start_s:02d},{start_ms:03d} --> {end_h:02d}:{end_m:02d}:{end_s:02d},{end_ms:03d}\n"
-                content += f"{sub['text']}\n\n"
+            version = session.subtitles_version  # letta prima della copia: al più si renderizza di più
+            etag = f'W/"{session.session_id}-t{version}"'
         else:
-            # Usa il file SRT originale
-            with open(session.srt_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Converti timestamp da formato con punto a formato con virgola (standard SRT)
-            # Whisper genera: 00:00:02.994 --> 00:00:05.574
-            # SRT standard:   00:00:02,994 --> 00:00:05,574
-            content = content.replace('.', ',')
+            st = os.stat(session.srt_path)
+            etag = f'W/"{session.session_id}-f{st.st_mtime_ns:x}-{st.st_size:x}"'
+        headers = {
+            'Content-Type': 'text/srt; charset=utf-8',
+            'Cache-Control': 'no-cache',  # no-store impedirebbe la rivalidazione con If-None-Match
+            'ETag': etag,
+            'Access-Control-Allow-Origin': '*'
+        }
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status=304, headers=headers)
         
-        print(f"[Subtitles] File SRT letto: {len(content)} caratteri, {len(content.splitlines())} righe")
+        if has_translated:
+            # I cue sono già formattati: qui solo la concatenazione, e solo se ne sono arrivati di nuovi
+            if session._srt_cache_version != version:
+                logger.debug("[Subtitles] ✅ Genero SRT da %d sottotitoli tradotti in %s", len(session.translated_subtitles), session.translate_to)
+                # copia: la deque può cambiare durante il giro
+                session._srt_cache = b"".join(list(session._srt_cues))  # bytes: Flask non ricodifica
+                session._srt_cache_version = version
+            return Response(session._srt_cache, mimetype='text/srt', headers=headers)
         
-        return Response(
-            content,
-            mimetype='text/srt',
-            headers={
-                'Content-Type': 'text/srt; charset=utf-8',
-                'Cache-Control': 'no-cache, no-store, must-revalidate',
-                'Access-Control-Allow-Origin': '*'
-            }
-        )
+        # Separatore dei timestamp del file, rilevato dal primo timestamp. Non si
+        # memorizza finché il file è ancora il segnaposto (con la virgola): il filtro
+        # Whisper lo sostituirà con timestamp col punto
+        srt_file = open(session.srt_path, 'rb')
+        comma = session._srt_comma
+        if comma is None:
+            head = srt_file.read(4096)
+            srt_file.seek(0)
+            m = _TS_SEP_RE.search(head)
+            if m and head != _SRT_PLACEHOLDER:
+                comma = session._srt_comma = m.group(1) == b','
+        
+        if comma:
+            # Già SRT standard: il file va al socket così com'è (file_wrapper/sendfile)
+            srt_file.close()
+            response = send_file(session.srt_path, mimetype='text/srt', conditional=True, etag=False, max_age=0)
+            response.headers.update(headers)
+            return response
+        else:
+            # Usa il file SRT originale, letto a blocchi e inviato con chunked transfer encoding
+            def generate():
+                # Converti timestamp da formato con punto a formato con virgola (standard SRT)
+                # Whisper genera: 00:00:02.994 --> 00:00:05.574
+                # SRT standard:   00:00:02,994 --> 00:00:05,574
+                # I blocchi sono tagliati all'ultimo a capo, così un timestamp non resta spezzato
+                pending = b""
+                with srt_file:
+                    while True:
+                        block = srt_file.read(64 * 1024)
+                        if not block:
+                            if pending:
+                                yield _TS_DOT_RE.sub(rb'\1,\2', pending)
+                            break
+                        block = pending + block
+                        cut = block.rfind(b"\n") + 1
+                        pending = block[cut:]
+                        if cut:
+                            yield _TS_DOT_RE.sub(rb'\1,\2', block[:cut])
+        
+        return Response(stream_with_context(generate()), mimetype='text/srt', headers=headers)
     except Exception as e:
-        print(f"[Subtitles] Errore lettura SRT: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[Subtitles] Errore lettura SRT: %s", e)
         return "Errore lettura sottotitoli", 500
 
 
+@app.route('/api/subtitles/<session_id>.vtt')
+def get_subtitles_vtt(session_id):
+    """Sottotitoli in WebVTT per il <track> del player (tradotti se disponibili)."""
+    session = sessions.get(session_id)
+    if session is None:
+        return "Sessione non trovata", 404
+    session.touch()
+    
+    subtitles = list(session.translated_subtitles or session.all_subtitles)
+    
+    return Response(
+        "WEBVTT\n\n" + _render_cues(subtitles, '.'),
+        mimetype='text/vtt',
+        headers={
+            'Content-Type': 'text/vtt; charset=utf-8',
+            'Cache-Control': 'no-cache, no-store, must-revalidate',
+            'Access-Control-Allow-Origin': '*'
+        }
+    )
+
+
 @app.route('/api/status/<session_id>')
 def get_status(session_id):
     """Stato della sessione."""
-    if session_id not in sessions:
-        return jsonify({'error': 'Sessione non trovata'}), 404
+    session = sessions.get(session_id)
+    if session is None:
+        return json_response({'error': 'Sessione non trovata'}, 404)
+    session.touch()
     
-    session = sessions[session_id]
+    # Restituisci i sottotitoli tradotti se disponibili, altrimenti quelli originali.
+    # Con ?since=<index> solo quelli successivi (il client tiene last_index), altrimenti gli ultimi 10.
+    # generation cambia quando l'SRT è riscritto da capo: il client allora riparte da zero,
+    # anche se i nuovi indici hanno già superato since tra due interrogazioni
+    generation = session.srt_generation
+    source = session.translated_subtitles if session.translated_subtitles else session.all_subtitles
+    since = request.args.get('since', type=int)
+    if since is None:
+        subtitles_to_return = _tail(source, 10)
+    else:
+        subtitles_to_return = _since(source, since)
+    if subtitles_to_return:
+        last_index = subtitles_to_return[-1]['index']
+    else:
+        last_index = since if since is not None else -1
     
-    # Restituisci i sottotitoli tradotti se disponibili, altrimenti quelli originali
-    subtitles_to_return = session.translated_subtitles if session.translated_subtitles else session.all_subtitles
+    logger.debug("[Status %s] Sottotitoli: %d originali, %d tradotti, restituiti %d",
+                 session_id, session._subtitle_count, session._translated_count, len(subtitles_to_return))
     
-    print(f"[Status {session_id}] Sottotitoli: {len(session.all_subtitles)} originali, {len(session.translated_subtitles)} tradotti")
-    print(f"[Status {session_id}] Restituisco {len(subtitles_to_return[-10:])} sottotitoli (tradotti: {len(session.translated_subtitles) > 0})")
-    
-    return jsonify({
+    return json_response({
         'status': session.status,
         'error': session.error,
-        'subtitles_count': len(session.all_subtitles),
-        'subtitles': subtitles_to_return[-10:] if subtitles_to_return else [],
+        'subtitles_count': session._subtitle_count,
+        'subtitles': subtitles_to_return,
+        'last_index': last_index,
+        'generation': generation,
         'translated': len(session.translated_subtitles) > 0
     })
 
@@ -779,14 +1359,39 @@ def get_status(session_id):
 @app.route('/api/stop/<session_id>', methods=['POST'])
 def stop_session(session_id):
     """Ferma una sessione."""
-    if session_id not in sessions:
-        return jsonify({'error': 'Sessione non trovata'}), 404
+    with _sessions_lock:
+        session = sessions.pop(session_id, None)
+    if session is None:
+        return json_response({'error': 'Sessione non trovata'}, 404)
     
-    session = sessions[session_id]
     session.cleanup()
-    del sessions[session_id]
     
-    return jsonify({'status': 'stopped'})
+    return json_response({'status': 'stopped'})
+
+
+# Sessioni senza richieste dei client per più di SESSION_TTL secondi vengono
+# chiuse: processo FFmpeg, slot e liste di sottotitoli non restano in memoria
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 600))
+JANITOR_INTERVAL = 60
+
+
+def _session_janitor():
+    """Thread di pulizia: ogni JANITOR_INTERVAL secondi rimuove le sessioni inattive."""
+    while True:
+        time.sleep(JANITOR_INTERVAL)
+        now = time.monotonic()
+        with _sessions_lock:
+            expired = [sid for sid, s in sessions.items() if now - s.last_activity > SESSION_TTL]
+            evicted = [sessions.pop(sid) for sid in expired]
+        for session in evicted:
+            print(f"[Janitor] Sessione {session.session_id} inattiva da più di {SESSION_TTL}s, rimossa")
+            try:
+                session.cleanup()
+            except Exception as e:
+                print(f"[Janitor] Errore cleanup {session.session_id}: {e}")
+
+
+threading.Thread(target=_session_janitor, daemon=True, name="session_janitor").start()
 
 
 if __name__ == '__main__':
@@ -802,5 +1407,13 @@ if __name__ == '__main__':
     print(f"Accessibile su: http://{args.host}:{args.port}")
     print()
     
-    app.run(host=args.host, port=args.port, threaded=True)
+    if HAS_WAITRESS:
+        # Pool di thread fisso: ogni stream MP4 occupa un thread per tutta la sessione,
+        # le altre richieste (stato, sottotitoli) usano quelli rimasti
+        wsgi_threads = int(os.environ.get('WSGI_THREADS', 32))
+        print(f"Server WSGI: waitress ({wsgi_threads} thread)")
+        waitress_serve(app, host=args.host, port=args.port, threads=wsgi_threads,
+                       connection_limit=1024, channel_timeout=600)
+    else:
+        app.run(host=args.host, port=args.port, threaded=True)
 